@@ -0,0 +1,50 @@
+"""
+Compares the json codecs available to Connection on recorded Mucklet frames.
+
+Every installed codec decodes each frame in benchmarks/data/events.jsonl and encodes a
+typical outbound request, and the time per frame is reported.
+
+	python benchmarks/codec.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Mucklet.codec import codecs
+
+EVENTS = os.path.join(os.path.dirname(__file__), "data", "events.jsonl")
+
+REQUEST = {"jsonrpc": "2.0",
+           "method" : "call.core.char.ccicqnu9gbrk70s5rrdg.ctrl.say",
+           "params" : {"msg": "Hello there! The lighthouse keeper went down to the harbour."},
+           "id"     : 1024, }
+
+
+def load_frames() -> list[str]:
+	with open(EVENTS, "r", encoding = "utf-8") as f:
+		return [line.strip() for line in f if line.strip()]
+
+
+def measure(func, items: list, iterations: int) -> float:
+	start = time.perf_counter()
+	for _ in range(iterations):
+		for item in items:
+			func(item)
+	return (time.perf_counter() - start) / (iterations * len(items))
+
+
+if __name__ == "__main__":
+	iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	frames = load_frames()
+	
+	for name, codec in codecs.items():
+		try:
+			codec = codec()
+		except ImportError:
+			print(f"{name:<8} not installed")
+			continue
+		decode = measure(codec.loads, frames, iterations)
+		encode = measure(codec.dumps, [REQUEST], iterations)
+		print(f"{name:<8} loads {decode * 1e6:8.2f} us/frame   dumps {encode * 1e6:8.2f} us/request")
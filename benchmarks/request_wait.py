@@ -0,0 +1,83 @@
+"""
+Micro-benchmark for Request.wait.
+
+A fake connection answers every request from a separate thread (the same way the
+websocket thread does), and we time how long the caller takes to wake up after
+the response has been delivered.  The old 100 ms sleep polling loop is measured
+alongside for comparison.
+
+	python benchmarks/request_wait.py [iterations]
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Mucklet.codec import Codec
+from Mucklet.ResClient import PromiseTable
+from Mucklet.ResClient import Request
+
+
+class EchoConnection:
+	"""Stands in for Connection, answering each request on a responder thread."""
+	
+	def __init__(self, round_trip: float = 0.002):
+		self.round_trip = round_trip
+		self.running = True
+		self.promises = PromiseTable()
+		self.codec = Codec()
+		self.delivered_at = {}
+		self.log_error = lambda *args, **kwargs: None
+	
+	def send_frame(self, data: str, method: str | None = None, written = None) -> None:
+		request_id = json.loads(data)["id"]
+		if written is not None:
+			written()
+		
+		def respond():
+			# simulate a round trip to the gateway
+			time.sleep(self.round_trip)
+			request = self.promises[request_id]
+			self.delivered_at[request_id] = time.perf_counter()
+			request.receive({"id": request_id, "result": {}})
+		
+		threading.Thread(target = respond).start()
+
+
+def legacy_wait(request: Request, time_out_period: int = 10) -> Request:
+	# the polling loop Request.wait used before it had a completion event
+	if request.sent_data is None:
+		request.send()
+	while time.time() - request.sent_time < time_out_period:
+		if request.received_data:
+			return request
+		time.sleep(0.1)
+	request.timed_out = True
+	return request
+
+
+def measure(wait, iterations: int) -> list[float]:
+	connection = EchoConnection()
+	latencies = []
+	for _ in range(iterations):
+		request = Request(connection, "call", "bench", "echo")
+		wait(request)
+		latencies.append(time.perf_counter() - connection.delivered_at[request.id])
+	return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+	latencies = sorted(latencies)
+	mean = sum(latencies) / len(latencies)
+	median = latencies[len(latencies) // 2]
+	print(f"{name:<8} mean {mean * 1e6:10.1f} us   median {median * 1e6:10.1f} us   "
+	      f"max {latencies[-1] * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+	iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+	report("event", measure(lambda request: request.wait(), iterations))
+	report("polling", measure(legacy_wait, iterations))
@@ -0,0 +1,314 @@
+"""
+End-to-end benchmark suite for the receive-to-handler pipeline, plus micro-benchmarks.
+
+A Bot is booted against the local Gateway, then synthetic frames (say/pose messages and
+change/add/remove events on cached resources) are fed straight into ResClient.on_message, so
+every frame goes through codec.loads -> process_response -> Cache.change/add/remove -> the
+Bot's event decoding -> the @bot.on handler. Frames/sec and per-message latency (from feeding
+the frame to the handler running) are reported, along with the cost of each stage on its own.
+The same messages are also sent over a real socket by the gateway.
+
+The micro-benchmarks cover Cache.get path resolution, Character property access and
+CachedDictionary reads and writes. Cold import times are measured in fresh interpreters, as
+they are what short-lived worker processes and tests pay.
+
+Results are written as json (by default to benchmarks/results/<commit>.json) so runs can be
+compared across commits:
+	
+	python benchmarks/suite.py [--frames 20000] [--output results.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Mucklet import Bot
+from Mucklet import Logger
+from Mucklet import ResClient
+from Mucklet import WARNING
+from Mucklet.CachedDictionary import CachedDictionary
+from Mucklet.gateway import Gateway
+from Mucklet.types import Character
+
+RESULTS = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentiles(values: list[float]) -> dict:
+	if not values:
+		return {}
+	values = sorted(values)
+	
+	def at(percent: float) -> float:
+		return values[min(len(values) - 1, int(len(values) * percent / 100))]
+	
+	return {"p50"    : at(50),
+	        "p95"    : at(95),
+	        "p99"    : at(99),
+	        "max"    : values[-1],
+	        "average": sum(values) / len(values), }
+
+
+def per_op(func, items: list, repeat: int = 3) -> float:
+	# best time per item over repeat runs, in seconds
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		for item in items:
+			func(item)
+		elapsed = (time.perf_counter() - start) / len(items)
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+class Harness:
+	"""A Bot booted against a local gateway, with a handler that records when each message arrives."""
+	
+	def __init__(self, characters: int = 200, rooms: int = 10, seed: int = 1):
+		self.gateway = Gateway().start()
+		self.characters = self.gateway.populate(characters, rooms, seed = seed)
+		self.client = ResClient(self.gateway.url, self.gateway.origin)
+		self.bot = Bot(self.gateway.token, self.client)
+		self.handled = {}
+		self.done = threading.Event()
+		self.expected = 0
+		
+		@self.bot.on("say", "pose")
+		def record(event):
+			self.handled[event.event.message] = time.perf_counter()
+			if len(self.handled) >= self.expected:
+				self.done.set()
+		
+		self.bot.boot()
+		# put every character and the bot's room in the cache, so change/add/remove events have a target
+		for id in self.characters:
+			self.client.cache.get(f"core.char.{id}", "name")
+		self.room = self.client.cache.get(f"core.char.{self.bot.id}", "inRoom", "id")
+		self.client.cache.get(f"core.room.{self.room}.details", "chars")
+	
+	def frames(self, count: int, changes: float = 0.2, seed: int = 1) -> tuple[list[str], int]:
+		# synthetic inbound frames, returns them with the number of messages among them
+		generator = random.Random(seed)
+		codec = self.client.codec
+		chars_rid = f"core.room.{self.room}.chars"
+		# never remove from an empty collection
+		size = len(self.client.cache.data.get(chars_rid, []))
+		frames = []
+		messages = 0
+		for index in range(count):
+			char_id = generator.choice(self.characters)
+			roll = generator.random()
+			if roll < changes * 0.8:
+				frame = {"event": f"core.char.{char_id}.change", "data": {"values": {"idle": index}}}
+			elif roll < changes * 0.9 or (roll < changes and not size):
+				size += 1
+				frame = {"event": f"{chars_rid}.add", "data": {"idx": 0, "value": {"rid": f"core.char.{char_id}"}}}
+			elif roll < changes:
+				size -= 1
+				frame = {"event": f"{chars_rid}.remove", "data": {"idx": 0}}
+			else:
+				messages += 1
+				frame = {"event": f"core.char.{self.bot.id}.out",
+				         "data" : {"id"  : f"event{index}",
+				                   "type": generator.choice(("say", "pose")),
+				                   "time": 1690799543339 + index,
+				                   "sig" : "signature",
+				                   "char": {"id": char_id, "name": "Name", "surname": "Surname"},
+				                   "msg" : str(index), }}
+			frames.append(codec.dumps(frame))
+		return frames, messages
+	
+	def expect(self, count: int) -> None:
+		self.handled = {}
+		self.expected = count
+		self.done.clear()
+	
+	def close(self) -> None:
+		self.client.close()
+		self.gateway.close()
+
+
+def pipeline(harness: Harness, count: int) -> dict:
+	frames, messages = harness.frames(count)
+	harness.expect(messages)
+	fed = [0.0] * len(frames)
+	start = time.perf_counter()
+	for index, frame in enumerate(frames):
+		fed[index] = time.perf_counter()
+		harness.client.on_message(None, frame)
+	feed_time = time.perf_counter() - start
+	harness.done.wait(60)
+	elapsed = time.perf_counter() - start
+	latencies = [harness.handled[str(index)] - fed[index] for index in range(len(frames))
+	             if str(index) in harness.handled]
+	return {"frames"           : len(frames),
+	        "messages"         : messages,
+	        "handled"          : len(harness.handled),
+	        "elapsed"          : elapsed,
+	        "frames_per_second": len(frames) / elapsed,
+	        "receive_per_frame": feed_time / len(frames),
+	        "latency"          : percentiles(latencies), }
+
+
+def stages(harness: Harness, count: int) -> dict:
+	# the cost of each stage of the pipeline on its own, per frame
+	frames, _ = harness.frames(count, changes = 1)
+	client = harness.client
+	decoded = [client.codec.loads(frame) for frame in frames]
+	
+	def mutate(message: dict) -> None:
+		rid, _, event = message["event"].rpartition(".")
+		data = message["data"]
+		if event == "change":
+			client.cache.change(rid, data["values"])
+		elif event == "add":
+			client.cache.add(rid, data["idx"], data["value"])
+		else:
+			client.cache.remove(rid, data["idx"])
+	
+	messages, _ = harness.frames(count, changes = 0)
+	decoded_messages = [client.codec.loads(frame) for frame in messages]
+	harness.expect(len(messages))
+	return {"decode"        : per_op(client.codec.loads, frames),
+	        # mutations are only applied once, replaying removes would empty the collection
+	        "cache_mutate"  : per_op(mutate, decoded, repeat = 1),
+	        "bot_on_message": per_op(client.on_events["message"], decoded_messages), }
+
+
+def socket(harness: Harness, count: int) -> dict:
+	# the same messages, sent over a real websocket by the gateway
+	harness.expect(count)
+	start = time.perf_counter()
+	harness.gateway.flood(count, changes = 0)
+	harness.done.wait(60)
+	elapsed = time.perf_counter() - start
+	return {"messages": count, "handled": len(harness.handled), "elapsed": elapsed,
+	        "messages_per_second": len(harness.handled) / elapsed, }
+
+
+def cache_get(harness: Harness, count: int) -> dict:
+	cache = harness.client.cache
+	bot_rid = f"core.char.{harness.bot.id}"
+	rids = [f"core.char.{id}" for id in harness.characters]
+	items = [rids[index % len(rids)] for index in range(count)]
+	return {"field"    : per_op(lambda rid: cache.get(rid, "name"), items),
+	        "reference": per_op(lambda _: cache.get(bot_rid, "inRoom", "name"), items),
+	        "missing"  : per_op(lambda rid: cache.get(rid, "missing"), items), }
+
+
+def character_properties(harness: Harness, count: int) -> dict:
+	characters = [Character(harness.bot, harness.characters[index % len(harness.characters)])
+	              for index in range(count)]
+	return {"name"     : per_op(lambda character: character.name, characters),
+	        "full_name": per_op(lambda character: character.full_name, characters),
+	        "awake"    : per_op(lambda character: character.awake, characters), }
+
+
+def cached_dictionary(count: int) -> dict:
+	directory = tempfile.mkdtemp()
+	try:
+		dictionary = CachedDictionary(os.path.join(directory, "storage"))
+		keys = [f"key{index}" for index in range(count)]
+		write = per_op(lambda key: dictionary.__setitem__(key, [key, 1]), keys, repeat = 1)
+		read = per_op(lambda key: dictionary[key], keys)
+		contains = per_op(lambda key: key in dictionary, keys)
+	finally:
+		shutil.rmtree(directory, ignore_errors = True)
+	return {"write": write, "read": read, "contains": contains}
+
+
+def import_time(repeat: int = 10) -> dict:
+	# seconds to import each in a fresh interpreter, best of repeat, the interpreter's own startup is not included
+	source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+	statements = {"package": "import Mucklet",
+	              "types"  : "from Mucklet import Character",
+	              "bot"    : "from Mucklet import Bot",
+	              "async"  : "from Mucklet import AsyncResClient",
+	              "star"   : "from Mucklet import *", }
+	results = {}
+	for name, statement in statements.items():
+		code = (f"import sys, time; sys.path.insert(0, {source!r}); start = time.perf_counter(); {statement}; "
+		        f"print(time.perf_counter() - start)")
+		results[name] = min(float(subprocess.check_output([sys.executable, "-c", code], text = True))
+		                    for _ in range(repeat))
+	return results
+
+
+def commit() -> str:
+	try:
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text = True,
+		                               cwd = os.path.dirname(os.path.abspath(__file__))).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+	flat = {}
+	for key, value in results.items():
+		if type(value) is dict:
+			flat.update(flatten(value, f"{prefix}{key}."))
+		else:
+			flat[f"{prefix}{key}"] = value
+	return flat
+
+
+def compare(old: dict, new: dict) -> None:
+	old, new = flatten(old["results"]), flatten(new["results"])
+	for key in new:
+		if key in old and type(new[key]) is float and old[key]:
+			print(f"{key:<48} {old[key]:>14.6g} -> {new[key]:<14.6g} {new[key] / old[key]:6.2f}x")
+
+
+def run(frames: int, micro: int) -> dict:
+	Logger.set_level(WARNING)
+	harness = Harness()
+	try:
+		results = {"pipeline"            : pipeline(harness, frames),
+		           "stages"              : stages(harness, min(frames, 5000)),
+		           "socket"              : socket(harness, min(frames, 5000)),
+		           "cache_get"           : cache_get(harness, micro),
+		           "character_properties": character_properties(harness, micro),
+		           "cached_dictionary"   : cached_dictionary(min(micro, 500)),
+		           "import_time"         : import_time(), }
+	finally:
+		harness.close()
+	return {"commit" : commit(),
+	        "time"   : time.time(),
+	        "python" : platform.python_version(),
+	        "codec"  : harness.client.codec.name,
+	        "results": results, }
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+	parser.add_argument("--frames", type = int, default = 20000)
+	parser.add_argument("--micro", type = int, default = 20000)
+	parser.add_argument("--output", default = None)
+	parser.add_argument("--compare", default = None, help = "an earlier result file to compare against")
+	arguments = parser.parse_args()
+	
+	report = run(arguments.frames, arguments.micro)
+	output = arguments.output or os.path.join(RESULTS, f"{report['commit']}.json")
+	os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+	with open(output, "w", encoding = "utf-8") as f:
+		json.dump(report, f, indent = 2)
+	
+	pipeline_results = report["results"]["pipeline"]
+	print(f"pipeline  {pipeline_results['frames_per_second']:10.0f} frames/s   "
+	      f"latency p50 {pipeline_results['latency']['p50'] * 1e6:.0f}us "
+	      f"p99 {pipeline_results['latency']['p99'] * 1e6:.0f}us")
+	print(f"socket    {report['results']['socket']['messages_per_second']:10.0f} messages/s")
+	print("import    " + "   ".join(f"{name} {seconds * 1000:.1f}ms"
+	                                for name, seconds in report["results"]["import_time"].items()))
+	print(f"wrote {output}")
+	if arguments.compare:
+		with open(arguments.compare, "r", encoding = "utf-8") as f:
+			compare(json.load(f), report)
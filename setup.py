@@ -26,5 +26,9 @@ setuptools.setup(
           'websocket-client',
           'bson',
     ],
+    extras_require = {
+        "async": ["websockets"],
+        "fast": ["orjson"],
+    },
     python_requires = ">=3.6"
 )
@@ -0,0 +1,274 @@
+import asyncio
+import threading
+import time
+from .codec import Codec
+from .ResClient import Batch
+from .ResClient import Request
+from .ResClient import ResClient
+from .writer import QueueLatency
+
+
+class AsyncRequest(Request):
+	"""
+	A Request that can be awaited.
+	
+	Awaiting the request sends it (if it has not been sent yet) and resolves to the request
+	itself once the response has arrived, the same object wait() would return.
+	"""
+	
+	def __init__(self, _connection, *method, notification: bool = False, **params):
+		super().__init__(_connection, *method, notification = notification, **params)
+		self.future = None
+		# resolved once the request is written, for wait_async to start its timeout from
+		self.sent_future = None
+	
+	def complete(self) -> None:
+		super().complete()
+		if self.future is None:
+			return
+		if self.connection.in_loop():
+			self.resolve_future()
+		else:
+			self.connection.loop.call_soon_threadsafe(self.resolve_future)
+	
+	def resolve_future(self) -> None:
+		if self.future is not None and not self.future.done():
+			self.future.set_result(self)
+	
+	def written(self) -> None:
+		# called by the writer coroutine, on the loop
+		super().written()
+		if self.sent_future is not None and not self.sent_future.done():
+			self.sent_future.set_result(None)
+	
+	async def wait_async(self, time_out_period: int = None) -> "AsyncRequest":
+		if self.sent_data is None:
+			# send the message
+			self.send()
+		if self.sent_data is None:
+			# the message could not be sent, so there is nothing to wait for
+			return self
+		if self.completed.is_set():
+			return self
+		if self.future is None:
+			self.future = self.connection.loop.create_future()
+		# the timeout starts once the message is written, not while it is queued
+		while not self.sent.is_set():
+			if self.sent_future is None:
+				self.sent_future = self.connection.loop.create_future()
+			try:
+				await asyncio.wait_for(asyncio.shield(self.sent_future), 1)
+			except asyncio.TimeoutError:
+				if self.connection.closing:
+					# closed before the message was written, it never will be
+					self.connection.promises.expire(self.id)
+					return self
+		
+		time_out_period = time_out_period or Request.time_out_period
+		deadline = self.sent_time + time_out_period
+		self.connection.promises.extend(self.id, deadline)
+		try:
+			await asyncio.wait_for(asyncio.shield(self.future), max(deadline - time.time(), 0))
+		except asyncio.TimeoutError:
+			self.connection.log_error(f"Message {self.id} has timed out", False)
+			self.connection.promises.expire(self.id)
+		return self
+	
+	def wait(self, time_out_period: int = None) -> "AsyncRequest":
+		if self.connection.in_loop():
+			# blocking here would stop the reader from ever delivering the response
+			self.connection.log_error(f"Message {self.id} cannot be waited on from the event loop, "
+			                          f"await it instead", False)
+			if self.sent_data is None:
+				self.send()
+			return self
+		return super().wait(time_out_period)
+	
+	def __await__(self):
+		return self.wait_async().__await__()
+
+
+class AsyncBatch(Batch):
+	"""A Batch of AsyncRequests, awaiting it waits on every request concurrently."""
+	
+	async def wait_async(self, time_out_period: int = None) -> "AsyncBatch":
+		self.send()
+		await asyncio.gather(*(request.wait_async(time_out_period) for request in self.requests))
+		return self
+	
+	def __await__(self):
+		return self.wait_async().__await__()
+
+
+class AsyncResClient(ResClient):
+	"""
+	An asyncio based ResClient.
+	
+	Frames are read by a single reader coroutine and written by a single writer coroutine.
+	Handlers registered with on() may be coroutine functions, which are run as tasks on the
+	loop, or plain functions, which are run on the loop's default executor so they may still
+	block on Request.wait().
+	
+	Requires the optional 'websockets' package.
+	"""
+	
+	def __init__(self, host: str, origin: str, workers: int = 4, queue_size: int = 1000,
+	             codec: Codec | str | None = None):
+		super().__init__(host, origin, workers, queue_size, codec)
+		self.loop = None
+		self.reader = None
+		self.write_task = None
+		self.frames_ready = None
+		self.latency = QueueLatency()
+		self.limiter.on_put = self.wake_writer
+	
+	def create_socket(self):
+		# the socket is opened by start() on the event loop
+		return None
+	
+	def request(self, *args, notification = False, **kwargs) -> AsyncRequest:
+		return AsyncRequest(self, *args, **kwargs, notification = notification)
+	
+	def batch(self, *requests: AsyncRequest) -> AsyncBatch:
+		return AsyncBatch(self, *requests)
+	
+	def in_loop(self) -> bool:
+		try:
+			return asyncio.get_running_loop() is self.loop
+		except RuntimeError:
+			return False
+	
+	async def start(self) -> "AsyncResClient":
+		self.loop = asyncio.get_running_loop()
+		self.frames_ready = asyncio.Event()
+		self.closing = False
+		await self.open_socket()
+		return self
+	
+	async def open_socket(self) -> None:
+		try:
+			import websockets
+		except ImportError:
+			raise ImportError("AsyncResClient requires the 'websockets' package, "
+			                  "install it with 'pip install mucklet[async]'")
+		
+		self.ws = await websockets.connect(self.host, origin = self.origin)
+		self.write_task = self.loop.create_task(self.write_forever())
+		self.reader = self.loop.create_task(self.read_forever())
+		self.on_open(self.ws)
+	
+	async def read_forever(self) -> None:
+		try:
+			async for frame in self.ws:
+				self.on_message(self.ws, frame)
+		except Exception as error:
+			self.on_error(self.ws, error)
+		finally:
+			self.write_task.cancel()
+			self.on_close(self.ws)
+			if not self.closing and self.reconnect:
+				self.loop.create_task(self.reconnect_forever())
+	
+	async def reconnect_forever(self) -> None:
+		while not self.closing:
+			delay = self.next_delay()
+			self.log_info(f"Connection lost, reconnecting in {delay:.1f}s (attempt {self.attempts})", False)
+			await asyncio.sleep(delay)
+			try:
+				await self.open_socket()
+				return
+			except Exception as error:
+				self.on_error(None, error)
+	
+	async def write_forever(self) -> None:
+		while True:
+			item, wait = self.limiter.poll()
+			if item is None:
+				# sleep until a frame is queued or the rate limiter lets the next one through
+				self.frames_ready.clear()
+				try:
+					await asyncio.wait_for(self.frames_ready.wait(), wait)
+				except asyncio.TimeoutError:
+					pass
+				continue
+			enqueued, data, written = item
+			if written is not None:
+				written()
+			if self.recorder is not None:
+				self.recorder.outbound(data)
+			await self.ws.send(data)
+			self.latency.observe([enqueued])
+	
+	def wake_writer(self) -> None:
+		if self.frames_ready is None:
+			return
+		if self.in_loop():
+			self.frames_ready.set()
+		else:
+			self.loop.call_soon_threadsafe(self.frames_ready.set)
+	
+	def connect(self) -> "AsyncResClient":
+		# run the event loop on its own thread so synchronous code (such as Bot.boot) can use the client
+		started = threading.Event()
+		errors = []
+		
+		def run_loop():
+			loop = asyncio.new_event_loop()
+			asyncio.set_event_loop(loop)
+			try:
+				loop.run_until_complete(self.start())
+			except Exception as error:
+				errors.append(error)
+				return
+			finally:
+				started.set()
+			loop.run_forever()
+		
+		threading.Thread(target = run_loop, daemon = True).start()
+		started.wait()
+		if errors:
+			raise errors[0]
+		return self
+	
+	def send_frame(self, data: str, method: str | None = None, written = None) -> None:
+		self.limiter.put((time.perf_counter(), data, written), method)
+	
+	@property
+	def writer_stats(self) -> dict:
+		return {"depth": self.limiter.depth, "lanes": self.limiter.depths, **self.latency.stats()}
+	
+	def dispatch(self, event: str, *args) -> None:
+		if not self.in_loop():
+			self.loop.call_soon_threadsafe(self.dispatch, event, *args)
+			return
+		if event == "message" and self.intercept is not None and args and self.intercept(args[0]):
+			return
+		handler = self.on_events[event]
+		if asyncio.iscoroutinefunction(handler):
+			self.loop.create_task(handler(*args))
+		else:
+			self.loop.run_in_executor(None, handler, *args)
+	
+	async def aclose(self) -> None:
+		self.closing = True
+		await self.ws.close()
+		self.promises.clear()
+		self.metrics.close()
+		self.stop_recording()
+	
+	def drop(self) -> None:
+		if self.ws is None:
+			return
+		self.attempts = self.last_attempts
+		if self.in_loop():
+			self.loop.create_task(self.ws.close())
+		else:
+			asyncio.run_coroutine_threadsafe(self.ws.close(), self.loop)
+	
+	def close(self):
+		if self.ws is None:
+			return
+		if self.in_loop():
+			self.loop.create_task(self.aclose())
+		else:
+			asyncio.run_coroutine_threadsafe(self.aclose(), self.loop).result()
@@ -1,5 +1,4 @@
 import os
-from ast import literal_eval as load
 
 
 class Storage:
@@ -12,6 +11,8 @@ class Storage:
 			if os.path.isdir(os.path.join(self.name, key)):
 				# if it is, return a CachedDictionary
 				return CachedDictionary(f"{os.path.join(self.name, key)}")
+			# imported here as it is only needed once something is read from disk
+			from ast import literal_eval as load
 			with open(os.path.join(self.name, key), "r") as f:
 				value = load(f.read())
 				if type(value) == dict:
@@ -185,6 +186,29 @@ class CachedDictionary(dict):
 		self.load()
 
 
+class LazyCachedDictionary:
+	"""
+	A CachedDictionary class attribute that is only created the first time it is used.
+	
+	Creating one at import time would tie it to the working directory of whatever imported the
+	module, and cost the import a filesystem lookup. The path can be changed until then (and after,
+	which starts a new dictionary).
+	"""
+	
+	def __init__(self, path: str):
+		self.path = path
+		self.dictionary = None
+	
+	def set_path(self, path: str) -> None:
+		self.path = path
+		self.dictionary = None
+	
+	def __get__(self, instance, owner) -> CachedDictionary:
+		if self.dictionary is None:
+			self.dictionary = CachedDictionary(self.path)
+		return self.dictionary
+
+
 if __name__ == "__main__":
 	test_storage = CachedDictionary("test")
 	test_storage["test"] = {"test": "test"}
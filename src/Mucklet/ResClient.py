@@ -1,13 +1,25 @@
-import websocket
-import json
+import random
 import time
 import threading
+from collections import OrderedDict
+from .log import ERROR
 from .log import Logger
+from .codec import Codec
+from .codec import get_codec
+from .dispatch import Dispatcher
+from .metrics import Metrics
+from .ratelimit import RateLimiter
+from .recorder import Recorder
+from .timers import Reaper
+from .writer import Writer
 
 
 class Request:
 	iteration = 0
 	time_out_period = 10
+	# how long an unanswered request may stay in the promise table, even if nothing waits on it
+	expiry_period = 30
+	callback_lock = threading.Lock()
 	
 	def __init__(self, _connection, *method, notification: bool = False, **params):
 		self.connection = _connection
@@ -30,9 +42,16 @@ class Request:
 		
 		self.received_data = None
 		self.sent_data = None
+		# when the writer wrote the request, set just before it goes out
 		self.sent_time = None
+		self.sent = threading.Event()
 		self.recieved_time = None
 		self.timed_out = False
+		# whether the request can safely be sent again after a reconnect
+		self.idempotent = self.method.split(".", 1)[0] in ("version", "get", "subscribe")
+		# set by receive (usually from the websocket thread) to wake any waiters
+		self.completed = threading.Event()
+		self.callbacks = []
 	
 	def send(self) -> "Request":
 		if self.sent_data:
@@ -45,19 +64,30 @@ class Request:
 			self.connection.log_error("Connection is not running")
 			return self
 		
-		if not self.notification:
-			# add the message to the promises
-			self.connection.promises[self.id] = self
-		# send the message
-		self.connection.ws.send(json.dumps(self.pending_data))
+		# record the send before writing, the response can arrive before ws.send returns
 		self.sent_data = self.pending_data.copy()
-		self.sent_time = time.time()
-		Logger.log_if_not_shown(f"Delivered - {self.sent_data}", (100, 200, 100))
+		if not self.notification:
+			# add the message to the promises, its deadline starts once it is written
+			self.connection.promises.add(self)
+		# queue the message, written is called once the rate limiter lets it through
+		self.connection.send_frame(self.connection.codec.dumps(self.sent_data), self.method, self.written)
+		Logger.log_if_not_shown(lambda: f"Delivered - {self.sent_data}", (100, 200, 100))
 		return self
 	
+	def written(self) -> None:
+		# called by the writer just before the frame goes out, so time spent queued behind the rate limiter
+		# neither counts towards the request's deadline nor its round trip time
+		self.sent_time = time.time()
+		if not self.notification:
+			self.connection.promises.extend(self.id, self.sent_time + Request.expiry_period)
+		self.sent.set()
+	
 	def resend(self) -> None:
 		self.sent_data = None
+		self.sent_time = None
+		self.sent.clear()
 		self.received_data = None
+		self.completed.clear()
 		self.send()
 	
 	def receive(self, data: dict) -> None:
@@ -66,23 +96,67 @@ class Request:
 		# remove the message from the promises
 		self.kill()
 		self.recieved_time = time.time()
+		# connections that only stand in for one (such as in tests and benchmarks) may keep no metrics
+		metrics = getattr(self.connection, "metrics", None)
+		if metrics is not None and self.sent_time is not None:
+			metrics.request(self.method, self.recieved_time - self.sent_time)
+		self.complete()
+	
+	def expire(self) -> None:
+		# the response is not coming, resolve the request with a timeout error instead
+		self.timed_out = True
+		metrics = getattr(self.connection, "metrics", None)
+		if metrics is not None:
+			metrics.timeout(self.method)
+		self.received_data = {"id"   : self.id,
+		                      "error": {"code"   : "system.timeout",
+		                                "message": f"Message {self.id} has timed out"}}
+		self.pending_data = None
+		self.complete()
+	
+	def complete(self) -> None:
+		# wake up anything blocked in wait()
+		self.completed.set()
+		self.run_callbacks()
+	
+	def then(self, callback) -> "Request":
+		# call callback(request) once the request has completed, straight away if it already has.
+		# callbacks run on the thread that completed the request (usually the websocket thread), keep them short
+		with Request.callback_lock:
+			self.callbacks.append(callback)
+		if self.completed.is_set():
+			self.run_callbacks()
+		return self
+	
+	def run_callbacks(self) -> None:
+		with Request.callback_lock:
+			callbacks, self.callbacks = self.callbacks, []
+		for callback in callbacks:
+			callback(self)
 		
 	def wait(self, time_out_period: int = None) -> "Request":
 		if self.sent_data is None:
 			# send the message
 			self.send()
-		time_out_period = time_out_period or Request.time_out_period
-		# while the message has not timed out
-		while time.time() - self.sent_time < time_out_period:
-			# if the message has been received
-			if self.received_data:
-				# return self
+		if self.sent_data is None:
+			# the message could not be sent, so there is nothing to wait for
+			return self
+		# the timeout starts once the message is written, not while it is queued
+		while not self.sent.wait(1):
+			if self.connection.closing:
+				# closed before the message was written, it never will be
+				self.connection.promises.expire(self.id)
 				return self
-			# sleep for 0.1 seconds
-			time.sleep(0.1)
+		time_out_period = time_out_period or Request.time_out_period
+		# block until receive() signals completion or the message times out
+		deadline = self.sent_time + time_out_period
+		# keep the promise around for at least as long as we are prepared to wait for it
+		self.connection.promises.extend(self.id, deadline)
+		if self.completed.wait(max(deadline - time.time(), 0)):
+			return self
 		# if the message has timed out
 		self.connection.log_error(f"Message {self.id} has timed out", False)
-		self.timed_out = True
+		self.connection.promises.expire(self.id)
 		return self
 	
 	def __str__(self) -> str:
@@ -107,57 +181,509 @@ class Request:
 		return self.received_data
 
 
+class Batch:
+	"""
+	A group of requests that are written back to back and waited on together.
+	
+	Can be used directly, client.batch(request, ...).wait(), or as a context manager, where
+	every request added inside the block is sent when the block exits:
+	
+		with client.batch() as batch:
+			batch.add(client.subscribe("core", "info"))
+			batch.add(client.subscribe("tag", "info"))
+		batch.wait()
+	"""
+	
+	def __init__(self, _connection, *requests: Request):
+		self.connection = _connection
+		self.requests = list(requests)
+	
+	def add(self, request: Request) -> Request:
+		self.requests.append(request)
+		return request
+	
+	def send(self) -> "Batch":
+		# write every request before waiting on any of them, so the whole batch costs one round trip
+		for request in self.requests:
+			if request.sent_data is None:
+				request.send()
+		return self
+	
+	def wait(self, time_out_period: int = None) -> "Batch":
+		self.send()
+		for request in self.requests:
+			request.wait(time_out_period)
+		return self
+	
+	def values(self) -> list[dict]:
+		return [request.value() for request in self.requests]
+	
+	@property
+	def errors(self) -> dict[Request, dict]:
+		return {request: request.received_data["error"] for request in self.requests
+		        if request.received_data and "error" in request.received_data}
+	
+	@property
+	def done(self) -> bool:
+		return all(request.completed.is_set() for request in self.requests)
+	
+	def __enter__(self) -> "Batch":
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback) -> None:
+		if exc_type is None:
+			self.send()
+	
+	def __getitem__(self, index: int) -> Request:
+		return self.requests[index]
+	
+	def __iter__(self):
+		return iter(self.requests)
+	
+	def __len__(self) -> int:
+		return len(self.requests)
+	
+	def __str__(self) -> str:
+		return "\n".join(str(request) for request in self.requests)
+
+
+class PromiseTable:
+	"""
+	The requests that are waiting for a response, keyed by request id.
+	
+	Every request is given a deadline, once it passes the request is removed and resolved with a
+	system.timeout error, so requests that never get a response do not stay in memory forever.
+	"""
+	
+	def __init__(self):
+		self.promises = {}
+		# id: the reaper entry of its deadline, [deadline, ...], cancelled once the request is done with
+		self.deadlines = {}
+		self.expired = 0
+		self.lock = threading.Lock()
+		self.reaper = Reaper("Mucklet-promise-reaper")
+	
+	def add(self, request: Request, deadline: float | None = None) -> None:
+		# without a deadline the request is kept until one is given by extend
+		with self.lock:
+			self.promises[request.id] = request
+			self.cancel(request.id)
+			if deadline is not None:
+				self.deadlines[request.id] = self.reaper.schedule(deadline, self.reap, request.id)
+	
+	def extend(self, id: int, deadline: float) -> None:
+		with self.lock:
+			if id not in self.promises or (id in self.deadlines and self.deadlines[id][0] >= deadline):
+				return
+			self.cancel(id)
+			self.deadlines[id] = self.reaper.schedule(deadline, self.reap, id)
+	
+	def cancel(self, id: int) -> None:
+		# drop the reaper's entry for id, called with the lock held
+		entry = self.deadlines.pop(id, None)
+		if entry is not None:
+			self.reaper.cancel(entry)
+	
+	def reap(self, id: int) -> None:
+		# the deadline may have been extended after the reaper took this entry
+		entry = self.deadlines.get(id)
+		if entry is not None and entry[0] <= time.time():
+			self.expire(id)
+	
+	def expire(self, id: int) -> None:
+		with self.lock:
+			request = self.promises.pop(id, None)
+			self.cancel(id)
+			if request is None:
+				return
+			self.expired += 1
+		request.expire()
+	
+	def pop(self, id: int, *default) -> Request:
+		with self.lock:
+			self.cancel(id)
+			return self.promises.pop(id, *default)
+	
+	def clear(self) -> None:
+		with self.lock:
+			self.promises.clear()
+			for id in list(self.deadlines):
+				self.cancel(id)
+	
+	def values(self) -> list[Request]:
+		return list(self.promises.values())
+	
+	def stats(self) -> dict:
+		return {"size"     : len(self.promises),
+		        "expired"  : self.expired,
+		        "deadlines": len(self.reaper)}
+	
+	def __getitem__(self, id: int) -> Request:
+		return self.promises[id]
+	
+	def __contains__(self, id: int) -> bool:
+		return id in self.promises
+	
+	def __len__(self) -> int:
+		return len(self.promises)
+
+
 class Cache:
-	def __init__(self, client: "ResClient", data: any = None):
+	# returned internally when a path can not be resolved, so a cached None is not mistaken for a miss
+	missing = object()
+	
+	def __init__(self, client: "ResClient", data: any = None, error_ttl: float = 60, max_subscriptions: int = 1000):
 		self.client = client
 		if data:
 			self.data = data
 		else:
 			self.data = {}
 		
-		self.errored = set()
+		# rid: time the failure is forgotten, so a resource that failed is retried eventually
+		self.errored = {}
+		self.error_ttl = error_ttl
+		# rid: the subscribe request in flight for it, shared by everything waiting on that rid
+		self.inflight = {}
+		self.lock = threading.Lock()
+		
+		# rid: number of direct subscriptions the gateway holds for this client
+		self.subscriptions = {}
+		# rid: how many of those the cache made itself (for a cache miss or retain), the only ones it unsubscribes
+		self.owned = {}
+		# rid: number of retain() calls not yet released
+		self.references = {}
+		# resources subscribed to because of a cache miss, least recently used first.
+		# once there are more than max_subscriptions the oldest are unsubscribed and evicted
+		self.recent = OrderedDict()
+		self.max_subscriptions = max_subscriptions
+		# rid: number of (hard) references to it from cached resources, so dropping a resource only has
+		# to look at what it referenced rather than at the whole cache
+		self.referrers = {}
+		for value in self.data.values():
+			self.link(value, 1)
+	
+	@staticmethod
+	def is_rid(key: any) -> bool:
+		# resource ids are dot separated (core.char.<id>), field names such as "name" never are
+		return type(key) is str and "." in key and " " not in key
 	
 	def get(self, *rids: str, default: any = None) -> any:
-		# follow the keys to the end, if there is a rid then start from the head with the rid and continue
+		# the first key is a resource id, the rest are fields within it. any resource reference
+		# found on the way ({"rid": ...}) is followed, subscribing to it if it is not cached yet
+		value, _ = self.walk(rids, block = True)
+		return default if value is Cache.missing else value
+	
+	def get_async(self, *rids: str, default: any = None, callback = None) -> any:
+		"""
+		Like get, but never blocks.
 		
-		position = self.data
-		for rid in rids:
-			try:
-				position = position[rid]
-				if type(position) is dict and "rid" in position:
-					position = self.get(position["rid"])
-			except KeyError:
-				if rid in self.errored:
-					return default
-				# we can try and subscribe to the resource
-				resource = self.client.subscribe(rid).wait()
-				if "error" in resource.value():
-					self.errored.add(rid)
-					return default
+		If the path can be resolved from the cache the value is returned (and passed to callback).
+		Otherwise the missing resource is subscribed to in the background, default is returned, and
+		callback is called with the value on a dispatch worker once it has arrived.
+		"""
+		value, missing = self.walk(rids, block = False)
+		if missing is None:
+			value = default if value is Cache.missing else value
+			if callback is not None:
+				callback(value)
+			return value
+		
+		request = self.fetch(missing)
+		if callback is not None:
+			request.then(lambda _: self.client.dispatcher.submit(
+					missing, lambda: self.get_async(*rids, default = default, callback = callback)))
+		return default
+	
+	def prefetch(self, *rids: str) -> list[Request]:
+		# subscribe to every rid that is not cached yet without waiting on any of them
+		return [self.fetch(rid) for rid in rids
+		        if rid not in self.data and self.is_rid(rid) and not self.is_errored(rid)]
+	
+	def walk(self, rids: tuple, block: bool) -> tuple[any, str | None]:
+		# returns (value, None) when the path resolves (value may be Cache.missing),
+		# or (Cache.missing, rid) when not blocking and rid has to be fetched first
+		if not rids:
+			return self.data, None
+		
+		position = Cache.missing
+		for index, key in enumerate(rids):
+			if index == 0:
+				rid = key
+			else:
+				try:
+					position = position[key]
+				except (KeyError, IndexError, TypeError):
+					return Cache.missing, None
+				if not (type(position) is dict and "rid" in position):
+					continue
+				rid = position["rid"]
+			
+			position, missing = self.lookup(rid, block)
+			if missing is not None or position is Cache.missing:
+				return Cache.missing, missing
+		
+		return position, None
+	
+	def lookup(self, rid: str, block: bool) -> tuple[any, str | None]:
+		try:
+			value = self.data[rid]
+		except KeyError:
+			pass
+		else:
+			if rid in self.recent:
 				try:
-					position = self.get(rid)
+					self.recent.move_to_end(rid)
 				except KeyError:
-					self.client.log_error(rid)
-					self.client.log_error(str(resource))
-					return default
+					pass
+			return value, None
+		if not self.is_rid(rid) or self.is_errored(rid):
+			return Cache.missing, None
+		if not block:
+			return Cache.missing, rid
+		
+		# we can try and subscribe to the resource
+		self.fetch(rid).wait()
+		return self.data.get(rid, Cache.missing), None
+	
+	def fetch(self, rid: str) -> Request:
+		# single flight, concurrent misses for the same rid share one subscribe request
+		with self.lock:
+			request = self.inflight.get(rid)
+			if request is not None:
+				return request
+			request = self.client.subscribe(rid)
+			self.inflight[rid] = request
+		
+		request.then(lambda response: self.settle(rid, response))
+		request.send()
+		if request.sent_data is None:
+			# the request could not be sent, do not leave it in flight forever
+			with self.lock:
+				self.inflight.pop(rid, None)
+		return request
+	
+	def settle(self, rid: str, request: Request) -> None:
+		stale = []
+		with self.lock:
+			self.inflight.pop(rid, None)
+			if rid not in self.data or "error" in request.received_data:
+				self.errored[rid] = time.time() + self.error_ttl
+				return
+			self.owned[rid] = self.owned.get(rid, 0) + 1
+			if self.references.get(rid):
+				# held by retain, so it is not a candidate for eviction
+				return
+			self.recent[rid] = None
+			# keep the number of cache miss subscriptions bounded, dropping the least recently used
+			while len(self.recent) > self.max_subscriptions:
+				oldest, _ = self.recent.popitem(last = False)
+				if not self.references.get(oldest):
+					stale.append(oldest)
+		for oldest in stale:
+			self.unsubscribe(oldest)
+	
+	def retain(self, rid: str) -> Request | None:
+		# hold a reference to rid, subscribing to it if it is not already subscribed
+		with self.lock:
+			self.references[rid] = self.references.get(rid, 0) + 1
+		if rid not in self.subscriptions:
+			return self.fetch(rid)
+		return None
+	
+	def release(self, rid: str) -> None:
+		# drop a reference taken by retain, unsubscribing once nothing holds the resource
+		with self.lock:
+			count = self.references.get(rid, 0) - 1
+			if count > 0:
+				self.references[rid] = count
+				return
+			self.references.pop(rid, None)
+			self.recent.pop(rid, None)
+		self.unsubscribe(rid)
+	
+	def unsubscribe(self, rid: str) -> Request | None:
+		# drop the subscriptions the cache made to rid, any made with ResClient.subscribe are left alone
+		with self.lock:
+			count = self.owned.pop(rid, 0)
+		if count == 0:
+			return None
+		return self.client.unsubscribe(rid, count = count).send()
+	
+	def track(self, request: Request) -> None:
+		# keep count of the direct subscriptions made by subscribe, unsubscribe, call and auth requests
+		if request.received_data is None or "error" in request.received_data:
+			return
+		method = request.method
+		with self.lock:
+			if method.startswith("subscribe."):
+				rid = method[len("subscribe."):]
+				self.subscriptions[rid] = self.subscriptions.get(rid, 0) + 1
+			elif method.startswith("unsubscribe."):
+				rid = method[len("unsubscribe."):]
+				count = self.subscriptions.get(rid, 0) - request.params.get("count", 1)
+				if count > 0:
+					self.subscriptions[rid] = count
+					if self.owned.get(rid, 0) > count:
+						self.owned[rid] = count
+				else:
+					self.subscriptions.pop(rid, None)
+					self.owned.pop(rid, None)
+					self.evict(rid, locked = True)
+			else:
+				result = request.received_data.get("result")
+				if type(result) is dict and "rid" in result:
+					self.subscriptions[result["rid"]] = self.subscriptions.get(result["rid"], 0) + 1
+	
+	def is_root(self, rid: str) -> bool:
+		# whether rid is held directly, by a subscription (or one lost to a reconnect and not yet restored), a retain()
+		# or a subscribe in flight
+		return (rid in self.subscriptions or rid in self.inflight or bool(self.references.get(rid))
+		        or rid in getattr(self.client, "lost_subscriptions", ()))
+	
+	def evict(self, rid: str, locked: bool = False) -> None:
+		# drop a resource that is no longer directly subscribed, along with everything only it referenced
+		if not locked:
+			with self.lock:
+				return self.evict(rid, True)
+		if self.is_root(rid):
+			return
+		self.recent.pop(rid, None)
+		self.collect([rid])
+	
+	def link(self, value: any, delta: int) -> list[str]:
+		# count (delta 1) or uncount (delta -1) the references in a value, returns the rids it references.
+		# any rid that loses a reference may have become unreachable, even if something still references it
+		rids = self.references_in(value)
+		for rid in rids:
+			count = self.referrers.get(rid, 0) + delta
+			if count > 0:
+				self.referrers[rid] = count
+			else:
+				self.referrers.pop(rid, None)
+		return rids
+	
+	def collect(self, rids: list[str], keep: str | None = None) -> int:
+		"""
+		Remove the resources among rids, and what they reference, that can no longer be reached.
+		
+		Only the group of cached resources reachable from rids without passing through a direct
+		subscription is looked at. A member of the group referenced more times than the group
+		itself references it is held from outside, so it and everything it references are kept,
+		the rest of the group is removed. keep is a resource the gateway is known to still send
+		events for, which is kept as well. Must be called with the lock held.
+		"""
+		group = set()
+		pending = list(rids)
+		while pending:
+			rid = pending.pop()
+			if rid in group or rid not in self.data or self.is_root(rid):
+				continue
+			group.add(rid)
+			pending.extend(self.references_in(self.data[rid]))
+		if not group:
+			return 0
 		
-		return position
+		inside = {}
+		for rid in group:
+			for child in self.references_in(self.data[rid]):
+				if child in group:
+					inside[child] = inside.get(child, 0) + 1
+		held = [rid for rid in group if self.referrers.get(rid, 0) > inside.get(rid, 0) or rid == keep]
+		while held:
+			rid = held.pop()
+			if rid in group:
+				group.discard(rid)
+				held.extend(self.references_in(self.data[rid]))
+		
+		for rid in group:
+			self.link(self.data.pop(rid), -1)
+			self.recent.pop(rid, None)
+		return len(group)
+	
+	def sweep(self) -> int:
+		# remove every cached resource that can not be reached from a direct subscription, a full pass over the
+		# cache that eviction does not need (it uses collect), but that can be run to check nothing was missed
+		with self.lock:
+			reachable = set()
+			pending = list(self.subscriptions) + list(self.references) + list(self.inflight)
+			while pending:
+				rid = pending.pop()
+				if rid in reachable:
+					continue
+				reachable.add(rid)
+				pending.extend(self.references_in(self.data.get(rid)))
+			
+			unreachable = [rid for rid in list(self.data) if rid not in reachable]
+			for rid in unreachable:
+				self.link(self.data.pop(rid), -1)
+				self.recent.pop(rid, None)
+		return len(unreachable)
+	
+	@staticmethod
+	def references_in(value: any) -> list[str]:
+		# the rids a model or collection references, soft references do not keep a resource subscribed
+		if type(value) is dict:
+			values = value.values()
+		elif type(value) is list:
+			values = value
+		else:
+			return []
+		return [item["rid"] for item in values
+		        if type(item) is dict and "rid" in item and not item.get("soft")]
+	
+	def is_errored(self, rid: str) -> bool:
+		expiry = self.errored.get(rid)
+		if expiry is None:
+			return False
+		if expiry > time.time():
+			return True
+		self.errored.pop(rid, None)
+		return False
 	
 	def set(self, rid: str, value: any) -> None:
-		self.data[rid] = value
+		with self.lock:
+			old = self.data.get(rid)
+			self.data[rid] = value
+			self.link(value, 1)
+			if old is not None:
+				# usually the same resource sent again, what it no longer references is left for the next eviction
+				self.link(old, -1)
 	
 	def change(self, rid: str, values: dict) -> None:
-		for key, value in values.items():
-			if value == {"action": "delete"}:
-				self.data[rid].pop(key)
-			else:
-				self.data[rid][key] = value
+		with self.lock:
+			model = self.data.get(rid)
+			if model is None:
+				# the resource has been evicted
+				return
+			dropped = []
+			for key, value in values.items():
+				old = model.get(key)
+				if value == {"action": "delete"}:
+					model.pop(key, None)
+				else:
+					model[key] = value
+					if type(value) is dict:
+						self.link([value], 1)
+				if type(old) is dict:
+					dropped += self.link([old], -1)
+			if dropped:
+				# a resource that can no longer be reached is dropped, as the gateway no longer sends its events
+				self.collect(dropped, keep = rid)
 	
 	def add(self, rid: str, index: int, value: dict) -> None:
-		self.data.get(rid).insert(index, value)
+		with self.lock:
+			collection = self.data.get(rid)
+			if collection is not None:
+				collection.insert(index, value)
+				self.link([value], 1)
 	
 	def remove(self, rid: str, index: int) -> None:
-		self.data.get(rid).pop(index)
+		with self.lock:
+			collection = self.data.get(rid)
+			if collection is not None:
+				dropped = self.link([collection.pop(index)], -1)
+				if dropped:
+					self.collect(dropped, keep = rid)
 	
 	def __getitem__(self, item: any) -> any:
 		return self.get(item)
@@ -166,7 +692,8 @@ class Cache:
 		self.set(key, value)
 	
 	def __delitem__(self, key: str) -> None:
-		self.data.pop(key)
+		with self.lock:
+			self.collect(self.link(self.data.pop(key), -1))
 	
 	def __str__(self) -> str:
 		return str(self.data)
@@ -179,86 +706,265 @@ class Cache:
 
 
 class Connection:
-	def __init__(self, host: str, origin: str):
+	def __init__(self, host: str, origin: str, workers: int = 4, queue_size: int = 1000,
+	             codec: Codec | str | None = None):
 		self.host = host
 		self.origin = origin
-		self.ws = websocket.WebSocketApp(self.host,
-		                                 on_message = self.on_message,
-		                                 on_error = self.on_error,
-		                                 on_close = self.on_close,
-		                                 on_open = self.on_open, )
+		# the json codec used for every frame, the fastest installed one unless told otherwise
+		self.codec = codec if isinstance(codec, Codec) else get_codec(codec)
+		self.ws = self.create_socket()
 		self.running = False
-		self.promises = {}
+		# set while the socket is open, so connect can wait for it rather than poll
+		self.opened = threading.Event()
+		self.closing = False
+		# the thread running the socket, started by connect
+		self.thread = None
+		self.promises = PromiseTable()
+		
+		# reconnect with exponential backoff (backoff * 2^attempt, capped at max_backoff, with jitter)
+		self.reconnect = True
+		self.backoff = 1
+		self.max_backoff = 60
+		self.attempts = 0
+		# the attempts the open connection took, so drop() can carry on backing off from there
+		self.last_attempts = 0
+		self.reconnects = 0
+		self.disconnected_at = None
+		self.downtime = 0
+		self.last_downtime = None
+		self.last_recovery = None
+		# handlers are run on a fixed pool of workers rather than a thread per frame. events are spread over them by
+		# dispatch_key, so all of a bot's chat (one out event) is decoded on one worker whatever the pool's size
+		self.dispatcher = Dispatcher(workers, queue_size)
+		# frames are paced by the rate limiter and written to the socket by a single thread
+		self.limiter = RateLimiter()
+		self.writer = Writer(self.write_frames, self.limiter)
 		self.log_info = Logger(format_color = (80, 80, 210), bold = False)
-		self.log_error = Logger(format_color = (210, 80, 80), bold = False)
+		self.log_error = Logger(format_color = (210, 80, 80), bold = False, level = ERROR)
 		self.log_success = Logger(format_color = (80, 210, 80), bold = False)
 		
+		self.metrics = Metrics()
+		self.metrics.gauge("promises", lambda: len(self.promises))
+		self.metrics.gauge("dispatch_queue_depth", lambda: self.queue_depth)
+		self.metrics.gauge("writer_queue_depth", lambda: self.writer_stats["depth"])
+		# called with each message event on the receiving thread before it is dispatched, it returns True for
+		# the events it takes, which are then not dispatched (Bot uses it to hand replies to wait_for)
+		self.intercept = None
+		# set by record() to capture every raw frame, and while a recording is being replayed
+		self.recorder = None
+		self.replaying = False
+		
 		self.on_events = {
-			"message": lambda message: self.log_info(f"Received - {message}", False),
+			"message": lambda message: self.log_info(lambda: f"Received - {message}", False),
 			"error"  : lambda error: self.log_error(f"Error - {error}", False),
 			"close"  : lambda: self.log_info("Connection closed", False),
 			"open"   : lambda: self.log_info("Connection opened", False),
 		}
 		
-	def connect(self) -> "Connection":
-		def run_forever():
-			self.ws.run_forever(origin = self.origin)
-		
-		threading.Thread(target = run_forever).start()
-		while not self.running:
-			time.sleep(0.1)
-		return self
+	def create_socket(self):
+		# imported here, so the asyncio client (and code that only wants the types) never needs websocket-client
+		import websocket
+		return websocket.WebSocketApp(self.host,
+		                              on_message = self.on_message,
+		                              on_error = self.on_error,
+		                              on_close = self.on_close,
+		                              on_open = self.on_open, )
 	
-	def on_message(self, ws, message):
-		message = json.loads(message)
+	def send_frame(self, data: str, method: str | None = None, written = None) -> None:
+		# queue the frame for the writer thread, this never blocks on the socket. written() is called just before
+		# the frame is written
+		self.writer.put(data, method, written)
+	
+	def write_frames(self, frames: list[str]) -> None:
+		sock = getattr(self.ws, "sock", None)
+		if sock is None or getattr(sock, "sock", None) is None:
+			self.log_error(f"Connection is not open, {len(frames)} frames were not sent", False)
+			return
+		if self.recorder is not None:
+			for frame in frames:
+				self.recorder.outbound(frame)
+		if len(frames) == 1:
+			sock.send(frames[0])
+			return
+		# build every frame first and write them together, one syscall rather than one per frame
+		data = b"".join(self.build_frame(sock, frame) for frame in frames)
+		with sock.lock:
+			sock.sock.sendall(data)
+	
+	@staticmethod
+	def build_frame(sock, data: str) -> bytes:
+		import websocket
+		frame = websocket.ABNF.create_frame(data, websocket.ABNF.OPCODE_TEXT)
+		if sock.get_mask_key:
+			frame.get_mask_key = sock.get_mask_key
+		return frame.format()
+	
+	@property
+	def writer_stats(self) -> dict:
+		return self.writer.stats()
+	
+	def dispatch(self, event: str, *args) -> None:
+		# hand the event to its handler without blocking the receiving thread,
+		# connection events share a key so open/close/error are handled in order
+		if event == "message" and self.intercept is not None and args and self.intercept(args[0]):
+			return
+		key = self.dispatch_key(args[0]) if event == "message" and args else event
+		self.dispatcher.submit(key, self.on_events[event], *args)
+	
+	@staticmethod
+	def dispatch_key(message: dict) -> any:
+		# events are ordered by the resource they are on, everything a bot hears in its room arrives on its
+		# core.char.<id>.out event, so the events of a room (and of every character in it) stay in order.
+		# the out event's payload has no room id to spread rooms over workers by, and a bot only hears its own room
+		event = message.get("event")
+		if event:
+			return event.rsplit(".", 1)[0]
+		return None
+	
+	@property
+	def queue_depth(self) -> int:
+		return self.dispatcher.depth
+	
+	def resolve(self, message: dict) -> None:
+		# complete the request this message is a response to
 		if "id" in message:
 			if message["id"] in self.promises:
 				self.promises[message["id"]].receive(message)
-			else:
+			elif not self.replaying:
 				self.log_error(f"Recieved message with id {message['id']} that was not sent by this client", False)
-		threading.Thread(target = self.on_events["message"], args = (message,)).start()
+	
+	def connect(self) -> "Connection":
+		self.closing = False
+		self.thread = threading.Thread(target = self.run_forever)
+		self.thread.start()
+		self.opened.wait()
+		return self
+	
+	def run_forever(self) -> None:
+		while True:
+			self.ws.run_forever(origin = self.origin)
+			if self.closing:
+				break
+			if not self.reconnect:
+				return
+			delay = self.next_delay()
+			self.log_info(f"Connection lost, reconnecting in {delay:.1f}s (attempt {self.attempts})", False)
+			time.sleep(delay)
+			if self.closing:
+				break
+			self.ws = self.create_socket()
+		# closed, the workers finish the close handlers queued above and then stop
+		self.dispatcher.close()
+	
+	def next_delay(self) -> float:
+		# full backoff for this attempt, scaled by a random jitter so many clients do not reconnect in step
+		delay = min(self.max_backoff, self.backoff * 2 ** self.attempts)
+		self.attempts += 1
+		return delay * random.uniform(0.5, 1)
+	
+	@property
+	def reconnect_stats(self) -> dict:
+		return {"reconnects"   : self.reconnects,
+		        "attempts"     : self.attempts,
+		        "connected"    : self.running,
+		        "downtime"     : self.downtime + (time.time() - self.disconnected_at if self.disconnected_at else 0),
+		        "last_downtime": self.last_downtime,
+		        "last_recovery": self.last_recovery, }
+	
+	def on_message(self, ws, message):
+		if self.recorder is not None:
+			self.recorder.inbound(message)
+		message = self.codec.loads(message)
+		self.resolve(message)
+		self.dispatch("message", message)
 		
 	def on_error(self, ws, error):
-		threading.Thread(target = self.on_events["error"], args = (error,)).start()
+		self.dispatch("error", error)
 	
-	def on_close(self, ws):
+	def on_close(self, ws, *args):
 		self.running = False
-		threading.Thread(target = self.on_events["close"]).start()
+		self.opened.clear()
+		if self.disconnected_at is None:
+			self.disconnected_at = time.time()
+		self.dispatch("close")
 	
 	def on_open(self, ws):
 		self.running = True
-		threading.Thread(target = self.on_events["open"]).start()
+		self.opened.set()
+		self.last_attempts, self.attempts = self.attempts, 0
+		if self.disconnected_at is not None:
+			# this is a reconnect
+			self.last_downtime = time.time() - self.disconnected_at
+			self.downtime += self.last_downtime
+			self.reconnects += 1
+			self.reconnected()
+		self.dispatch("open")
+	
+	def drop(self) -> None:
+		# close the socket but not the client, so it reconnects (backing off further than the last time)
+		# and the open handlers run again
+		self.attempts = self.last_attempts
+		sock = getattr(getattr(self.ws, "sock", None), "sock", None)
+		if sock is not None:
+			# shutting the socket down wakes the receiving thread straight away, ws.close() leaves it
+			# waiting out its select timeout
+			import socket
+			sock.shutdown(socket.SHUT_RDWR)
+	
+	def reconnected(self) -> None:
+		# called on the websocket thread before the open handlers run after a reconnect
+		pass
+	
+	def resume(self) -> None:
+		# called once the open handlers have re-run the handshake after a reconnect
+		if self.disconnected_at is not None:
+			self.last_recovery = time.time() - self.disconnected_at
+			self.disconnected_at = None
 	
 	def request(self, *args, notification = False, **kwargs) -> Request:
 		return Request(self, *args, **kwargs, notification = notification)
 	
+	def batch(self, *requests: Request) -> Batch:
+		return Batch(self, *requests)
+	
+	def record(self, path: str) -> Recorder:
+		# append every raw frame sent and received from now on to path (gzip compressed if it ends in .gz)
+		self.stop_recording()
+		self.recorder = Recorder(path)
+		return self.recorder
+	
+	def stop_recording(self) -> None:
+		recorder, self.recorder = self.recorder, None
+		if recorder is not None:
+			recorder.close()
+	
 	def emulate(self, **message) -> None:
-		if "id" in message:
-			if message["id"] in self.promises:
-				self.promises[message["id"]].receive(message)
-			else:
-				self.log_error(f"Recieved message with id {message['id']} that was not sent by this client", False)
-		threading.Thread(target = self.on_events["message"], args = (message,)).start()
+		self.resolve(message)
+		self.dispatch("message", message)
 
 
 class ResClient(Connection):
-	def __init__(self, host: str, origin: str):
-		super().__init__(host, origin)
+	def __init__(self, host: str, origin: str, workers: int = 4, queue_size: int = 1000,
+	             codec: Codec | str | None = None):
+		super().__init__(host, origin, workers, queue_size, codec)
 		
 		self.cache = Cache(self)
 		self.cache.head = self.cache
+		self.metrics.gauge("cached_resources", lambda: len(self.cache.data))
+		self.metrics.gauge("subscriptions", lambda: len(self.cache.subscriptions))
+		# the direct subscriptions held before the connection was lost, restored by resume()
+		self.lost_subscriptions = {}
 
 	def on_message(self, ws, response):
-		response = json.loads(response)
-		if "id" in response:
-			if response["id"] in self.promises:
-				self.promises[response["id"]].receive(response)
-			else:
-				self.log_error(f"Recieved message with id {response['id']} that was not sent by this client", False)
+		if self.recorder is not None:
+			self.recorder.inbound(response)
+		response = self.codec.loads(response)
+		# cache the response before completing its request, so whoever is waiting on it finds the data
 		self.process_response(response)
+		self.resolve(response)
 
 	def process_response(self, response: dict) -> None:
-		Logger.log_if_not_shown(str(response))
+		Logger.log_if_not_shown(lambda: str(response))
 		
 		if "result" in response:
 			result = response.get("result", {})
@@ -290,6 +996,8 @@ class ResClient(Connection):
 			event = response.get("event", {}).split(".")
 			rid = ".".join(event[:-1])
 			event = event[-1]
+			# count events by type, message events (out) by their message type as well (out.say)
+			self.metrics.event(f"out.{data.get('type')}" if event == "out" and type(data) is dict else event)
 			
 			if event == "change":
 				self.cache.change(rid, data.get("values", {}))
@@ -300,11 +1008,18 @@ class ResClient(Connection):
 			if event == "remove":
 				self.cache.remove(rid, data.get("idx", 0))
 			
+			if event == "unsubscribe":
+				# the gateway has dropped our subscription (e.g. access was revoked)
+				with self.cache.lock:
+					self.cache.subscriptions.pop(rid, None)
+					self.cache.owned.pop(rid, None)
+					self.cache.evict(rid, locked = True)
+			
 			if event in ["add", "change", "create", "delete", "patch", "reset", "reaccess", "remove", "unsubscribe"]:
 				return
 			
 			else:
-				threading.Thread(target = self.on_events["message"], args = (response,)).start()
+				self.dispatch("message", response)
 	
 	def display_errors(self, errors: dict) -> None:
 		for service, error in errors.items():
@@ -378,7 +1093,7 @@ class ResClient(Connection):
 				Any resource reference that fails will not lead to an error response, but
 				the error will be added to the resource set errors.
 		"""
-		return self.request("subscribe", *rid)
+		return self.request("subscribe", *rid).then(self.cache.track)
 	
 	def unsubscribe(self, *rid, count = 1):
 		"""
@@ -411,6 +1126,7 @@ class ResClient(Connection):
 				direct subscriptions. If so, the number of direct subscriptions will be
 				unaffected.
 		"""
+		return self.request("unsubscribe", *rid, count = count).then(self.cache.track)
 	
 	def get(self, *rid):
 		"""
@@ -485,7 +1201,7 @@ class ResClient(Connection):
 				An error response will be sent if the method couldn't be called,
 				or if the method was called, but an error was encountered.
 		"""
-		return self.request("call", *rid, **kwargs)
+		return self.request("call", *rid, **kwargs).then(self.cache.track)
 	
 	def auth(self, *rid, **params):
 		"""
@@ -525,7 +1241,7 @@ class ResClient(Connection):
 			An error response will be sent if the resource could not be created,
 			or if an error was encountered retrieving the newly created resource.
 		"""
-		return self.request("auth", *rid, **params)
+		return self.request("auth", *rid, **params).then(self.cache.track)
 	
 	def on(self, event: str):
 		if event not in self.on_events:
@@ -538,11 +1254,52 @@ class ResClient(Connection):
 		
 		return decorator
 	
+	def reconnected(self) -> None:
+		# a new connection starts without any subscriptions
+		with self.cache.lock:
+			self.lost_subscriptions.update(self.cache.subscriptions)
+			self.cache.subscriptions.clear()
+	
+	def resume(self) -> Batch:
+		"""
+		Restore the client's state after a reconnect.
+		
+		Resubscribes to every resource that was directly subscribed before the connection was lost
+		(and has not been subscribed again by the handshake), and resends in-flight requests that are
+		safe to repeat. Anything else that was in flight is expired. Should be called once the
+		handshake (version, authentication) has been repeated, Bot does this itself.
+		"""
+		if self.disconnected_at is None:
+			# nothing was lost, this is the first connection
+			return self.batch()
+		lost, self.lost_subscriptions = self.lost_subscriptions, {}
+		# as many subscriptions to each resource as there were, so the cache's own can still be told apart
+		requests = [self.subscribe(rid) for rid, count in lost.items()
+		            for _ in range(count - self.cache.subscriptions.get(rid, 0))]
+		for request in self.promises.values():
+			if request.sent_time is not None and request.sent_time < self.disconnected_at:
+				if request.idempotent:
+					self.promises.pop(request.id, None)
+					requests.append(request)
+					request.resend()
+				else:
+					self.promises.expire(request.id)
+		restored = self.batch(*requests).send()
+		super().resume()
+		self.log_info(f"Resumed {len(requests)} subscriptions and requests after reconnecting", False)
+		return restored
+	
 	def close(self):
+		self.closing = True
 		self.ws.close()
+		if self.thread is None or not self.thread.is_alive():
+			# otherwise the socket's thread stops the workers once it has queued its close handlers
+			self.dispatcher.close()
 		self.promises.clear()
+		self.metrics.close()
+		self.stop_recording()
 	
 	def new(self):
 		cls = self.__class__
-		result = cls(self.host, self.origin)
+		result = cls(self.host, self.origin, self.dispatcher.workers, self.dispatcher.queue_size, self.codec)
 		return result
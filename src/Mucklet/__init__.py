@@ -1,5 +1,60 @@
-from .CachedDictionary import *
-from .log import *
-from .ResClient import *
-from .types import *
-from .bot import *
+import importlib
+import sys
+from types import ModuleType
+
+# every public name and the module it is defined in, a module is only imported once one of its names is used
+# so that importing the package (or only the types) does not pay for websocket, asyncio and the rest
+exports = {"CachedDictionary": ("CachedDictionary", "LazyCachedDictionary", "Storage"),
+           "log"             : ("DEBUG", "ERROR", "INFO", "LogWriter", "Logger", "TRACE", "WARNING"),
+           "codec"           : ("Codec", "OrjsonCodec", "UjsonCodec", "codecs", "get_codec"),
+           "dispatch"        : ("Dispatcher",),
+           "timers"          : ("Reaper",),
+           "metrics"         : ("Histogram", "Metrics"),
+           "recorder"        : ("INBOUND", "OUTBOUND", "Recorder", "Replay", "read_recording"),
+           "ratelimit"       : ("RateLimiter", "TokenBucket"),
+           "writer"          : ("QueueLatency", "Writer"),
+           "waiters"         : ("Waiter", "Waiters"),
+           "commands"        : ("Command", "CommandRouter"),
+           "handlers"        : ("Handler", "HandlerIndex"),
+           "runner"          : ("HandlerRunner",),
+           "boot"            : ("BootGraph", "BootStep"),
+           "ResClient"       : ("Batch", "Cache", "Connection", "PromiseTable", "Request", "ResClient"),
+           "AsyncResClient"  : ("AsyncBatch", "AsyncRequest", "AsyncResClient"),
+           "types"           : ("Area", "AreaSnapshot", "Character", "CharacterMessageEvent",
+                                "CharacterPoseableMessageEvent", "CharacterSnapshot", "Entity", "EntityMap", "EventBase",
+                                "Exit", "ExitSnapshot", "Room", "RoomSnapshot", "TargetRoomMessageEvent",
+                                "TargetedCharacterEvent", "TargetedCharacterMessageEvent", "reference_id"),
+           "bot"             : ("Bot",), }
+
+modules = {name: module for module, names in exports.items() for name in names}
+
+__all__ = list(modules)
+
+
+def __getattr__(name: str) -> any:
+	module = modules.get(name)
+	if module is None:
+		if name in exports:
+			# a submodule, such as Mucklet.types
+			return importlib.import_module(f".{name}", __name__)
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+	value = getattr(importlib.import_module(f".{module}", __name__), name)
+	# cache it on the package, so the next lookup does not come back here
+	globals()[name] = value
+	return value
+
+
+def __dir__() -> list[str]:
+	return sorted(set(globals()) | set(modules))
+
+
+class Package(ModuleType):
+	def __setattr__(self, name: str, value: any) -> None:
+		# importing a submodule sets it on the package, but CachedDictionary, ResClient and AsyncResClient are
+		# also classes in those modules, and the classes are what the package has always exported under those names
+		if type(value) is ModuleType and modules.get(name) == name and value.__name__ == f"{__name__}.{name}":
+			value = getattr(value, name)
+		super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = Package
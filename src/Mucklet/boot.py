@@ -0,0 +1,117 @@
+import threading
+import time
+import traceback
+from .log import ERROR
+from .log import Logger
+
+
+class BootStep:
+	__slots__ = ("name", "func", "after", "started", "finished", "failed")
+	
+	def __init__(self, name: str, func, after: tuple[str, ...] = ()):
+		self.name = name
+		self.func = func
+		self.after = after
+		self.started = None
+		self.finished = None
+		self.failed = False
+	
+	@property
+	def duration(self) -> float | None:
+		return None if self.finished is None else self.finished - self.started
+
+
+class BootGraph:
+	"""
+	Runs a set of steps, each as soon as every step it comes after has finished.
+	
+	Steps that do not depend on each other run at the same time on their own threads, so the
+	whole graph takes as long as its longest chain of round trips rather than the sum of them.
+	A step that raises is logged and every step after it is skipped. When each step started and
+	how long it took is kept, to see where the time went.
+		
+		graph = BootGraph()
+		graph.add("authenticate", authenticate)
+		graph.add("get_bot", get_bot, after = ("authenticate",))
+		graph.add("subscribe", subscribe, after = ("authenticate",))
+		graph.run()
+	"""
+	
+	def __init__(self):
+		self.steps = {}
+		self.condition = threading.Condition()
+		self.started = None
+		self.finished = None
+		self.log_error = Logger(format_color = (210, 80, 80), bold = False, level = ERROR)
+	
+	def add(self, name: str, func, after: tuple[str, ...] = ()) -> BootStep:
+		step = self.steps[name] = BootStep(name, func, tuple(after))
+		return step
+	
+	def ready(self, step: BootStep) -> bool:
+		return step.started is None and all(self.steps[name].finished is not None and not self.steps[name].failed
+		                                    for name in step.after)
+	
+	def blocked(self, step: BootStep) -> bool:
+		# a step that can never run, as a step it comes after failed (or was itself skipped)
+		return any(self.steps[name].failed for name in step.after)
+	
+	def run(self, timeout: float | None = None) -> bool:
+		# run every step, returns whether they all finished without failing
+		for step in self.steps.values():
+			for name in step.after:
+				if name not in self.steps:
+					raise ValueError(f"Boot step {step.name} comes after unknown step {name}")
+		self.started = time.perf_counter()
+		deadline = None if timeout is None else time.time() + timeout
+		with self.condition:
+			while True:
+				changed = True
+				while changed:
+					changed = False
+					for step in self.steps.values():
+						if step.started is None and self.blocked(step):
+							# skipped, it counts as failed so the steps after it are skipped too
+							step.started = step.finished = time.perf_counter()
+							step.failed = changed = True
+						elif self.ready(step):
+							step.started = time.perf_counter()
+							threading.Thread(target = self.run_step, args = (step,), daemon = True,
+							                 name = f"Mucklet-boot-{step.name}").start()
+				if all(step.finished is not None for step in self.steps.values()):
+					break
+				if not any(step.started is not None and step.finished is None for step in self.steps.values()):
+					raise ValueError(f"Boot steps depend on each other - "
+					                 f"{[step.name for step in self.steps.values() if step.started is None]}")
+				remaining = None if deadline is None else deadline - time.time()
+				if remaining is not None and remaining <= 0:
+					self.log_error(f"Boot timed out waiting for "
+					               f"{[step.name for step in self.steps.values() if step.finished is None]}", False)
+					return False
+				self.condition.wait(remaining)
+		self.finished = time.perf_counter()
+		return not any(step.failed for step in self.steps.values())
+	
+	def run_step(self, step: BootStep) -> None:
+		failed = False
+		try:
+			step.func()
+		except BaseException:
+			# also catches the SystemExit of a step that gave up
+			failed = True
+			self.log_error(f"Boot step {step.name} failed:\n{traceback.format_exc()}", False)
+		with self.condition:
+			step.failed = failed
+			step.finished = time.perf_counter()
+			self.condition.notify()
+	
+	@property
+	def duration(self) -> float | None:
+		return None if self.finished is None else self.finished - self.started
+	
+	def times(self) -> dict:
+		# step name: when it started (from the start of the graph) and how long it took, in seconds
+		return {step.name: {"start"   : None if step.started is None else step.started - self.started,
+		                    "duration": step.duration,
+		                    "failed"  : step.failed, }
+		        for step in self.steps.values()}
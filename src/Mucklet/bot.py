@@ -1,23 +1,35 @@
 from .ResClient import ResClient
 from .ResClient import Request
+from .log import ERROR
 from .log import Logger
 from .types import Character
 from .types import Room
 from .types import Exit
+from .types import EntityMap
 from .types import EventBase
 from .types import CharacterMessageEvent
 from .types import CharacterPoseableMessageEvent
 from .types import TargetedCharacterMessageEvent
 from .types import TargetRoomMessageEvent
 from .types import TargetedCharacterEvent
+from .waiters import Waiters
+from .commands import CommandRouter
+from .handlers import Handler
+from .handlers import HandlerIndex
+from .runner import HandlerRunner
+from .boot import BootGraph
+import re
+import threading
 import time
 import sys
 
 
 class Bot:
-	def __init__(self, token: str, client: ResClient):
+	def __init__(self, token: str, client: ResClient, workers: int = 8):
 		self.token = token
 		self.client = client
+		# handlers are run here, coroutine functions on an event loop and plain functions on a pool of worker threads
+		self.runner = HandlerRunner(client.metrics, workers)
 		self.rid = None
 		self.id = None
 		self.name = None
@@ -25,36 +37,45 @@ class Bot:
 		self.full_name = None
 		self.description = None
 		self.booted = False
+		# how many times the bot has booted, a failed boot is retried once it has booted before
+		self.boots = 0
 		self.log_info = Logger((75, 75, 200))
-		self.log_error = Logger((200, 75, 75), True)
+		self.log_error = Logger((200, 75, 75), True, ERROR)
 		self.log_success = Logger((75, 200, 75))
-		self.on_calls = {"say"           : [],
-		                 "pose"          : [],
-		                 "wakeup"        : [],
-		                 "sleep"         : [],
-		                 "leave"         : [],
-		                 "arrive"        : [],
-		                 "describe"      : [],
-		                 "action"        : [],
+		# set once the boot steps have run (cleared while they run again after a reconnect),
+		# boot_times has when each started and how long it took
+		self.ready = threading.Event()
+		self.boot_timeout = 60
+		self.boot_times = {}
+		self.boot_duration = None
+		# event type: the @bot.on handlers for it, indexed by their filters
+		self.on_calls = {"say"           : HandlerIndex(),
+		                 "pose"          : HandlerIndex(),
+		                 "wakeup"        : HandlerIndex(),
+		                 "sleep"         : HandlerIndex(),
+		                 "leave"         : HandlerIndex(),
+		                 "arrive"        : HandlerIndex(),
+		                 "describe"      : HandlerIndex(),
+		                 "action"        : HandlerIndex(),
 		                 
-		                 "ooc"           : [],
+		                 "ooc"           : HandlerIndex(),
 		                 
-		                 "whisper"       : [],
-		                 "message"       : [],
-		                 "warn"          : [],
-		                 "mail"          : [],
-		                 "address"       : [],
-		                 "controlRequest": [],
+		                 "whisper"       : HandlerIndex(),
+		                 "message"       : HandlerIndex(),
+		                 "warn"          : HandlerIndex(),
+		                 "mail"          : HandlerIndex(),
+		                 "address"       : HandlerIndex(),
+		                 "controlRequest": HandlerIndex(),
 		                 
-		                 "travel"        : [],
+		                 "travel"        : HandlerIndex(),
 		                 
-		                 "summon"        : [],
-		                 "join"          : [],
-		                 "leadRequest"   : [],
-		                 "followRequest" : [],
-		                 "follow"        : [],
-		                 "stopFollow"    : [],
-		                 "stopLead"      : [], }
+		                 "summon"        : HandlerIndex(),
+		                 "join"          : HandlerIndex(),
+		                 "leadRequest"   : HandlerIndex(),
+		                 "followRequest" : HandlerIndex(),
+		                 "follow"        : HandlerIndex(),
+		                 "stopFollow"    : HandlerIndex(),
+		                 "stopLead"      : HandlerIndex(), }
 		
 		self.match_types = {"say"           : CharacterMessageEvent,
 		                    "pose"          : CharacterMessageEvent,
@@ -83,8 +104,17 @@ class Bot:
 		                    "follow"        : TargetedCharacterEvent,
 		                    "stopFollow"    : TargetedCharacterEvent,
 		                    "stopLead"      : TargetedCharacterEvent, }
+		# event type: the function that turns its data into an event object, built from match_types
+		self.decoders = {event_type: event_class.decode for event_type, event_class in self.match_types.items()}
 		
-		self.waiting_for_response_from = {}  # dict[character: time_sent]
+		# every pending wait_for, keyed by the id of the character being waited on
+		self.waiters = Waiters()
+		# the "!" commands, the built in character privacy commands and any added with @bot.command
+		self.commands = CommandRouter()
+		self.commands.add("get local cache", self.get_local_cache, args = {})
+		self.commands.add("revoke local cache", self.revoke_local_cache, args = {})
+		# (type, id): the Character, Room, Area or Exit with that id, shared while anything still uses it
+		self.entities = EntityMap()
 	
 	def get_error(self, response: Request, kill: bool = True) -> bool:
 		# if there is no error then return False
@@ -118,18 +148,18 @@ class Bot:
 		self.log_info("Retrieving protocol version")
 		version = self.client.version("1.2.1").wait()
 		self.get_error(version)
-		self.log_success(f"Successfully retrieved protocol version - {version.value().get('result').get('protocol')}")
+		self.log_success(lambda: f"Successfully retrieved protocol version - {version.value().get('result').get('protocol')}")
 		return version.value().get('result').get('protocol')
 	
 	def authenticate(self) -> None:
-		self.log_info(f"Authenticating bot - {self.token:.5}...")
+		self.log_info(lambda: f"Authenticating bot - {self.token:.5}...")
 		auth = self.client.auth("auth", "authenticateBot",
 		                        token = self.token).wait()
 		self.get_error(auth, True)
 		self.log_success("Successfully authenticated bot")
 	
 	def get_bot(self) -> None:
-		self.log_info(f"Retrieving bot - {self.token:.5}...")
+		self.log_info(lambda: f"Retrieving bot - {self.token:.5}...")
 		bot = self.client.call("core", "getBot").wait()
 		self.get_error(bot)
 		
@@ -143,7 +173,7 @@ class Bot:
 		self.full_name = f"{self.name} {self.surname}"
 		self.description = data.get("desc")
 		self.id = data.get("id")
-		self.log_success(f"Successfully retrieved bot - {self.full_name}")
+		self.log_success(lambda: f"Successfully retrieved bot - {self.full_name}")
 	
 	def control_bot(self) -> None:
 		self.log_info("Controlling bot")
@@ -153,197 +183,232 @@ class Bot:
 		self.log_success("Successfully controlled bot")
 	
 	def subscribe_to_all(self) -> None:
-		self.client.subscribe("core", "info").send()
-		self.client.subscribe("tag", "info").send()
-		self.client.subscribe("mail", "info").send()
-		self.client.subscribe("note", "info").send()
-		self.client.subscribe("report", "info").send()
-		self.client.subscribe("support", "info").send()
-		self.client.subscribe("client", "web", "info").send()
-		self.client.subscribe("core", "nodes").send()
-		self.client.subscribe("tags", "tags").send()
-		self.client.subscribe("tags", "groups").send()
-		self.client.subscribe("core", "chars", "awake").send()
-		
-	def on(self, *event: str):
+		self.log_info("Subscribing to resources")
+		# send every subscription at once, then wait for them together
+		subscriptions = self.client.batch(self.client.subscribe("core", "info"),
+		                                  self.client.subscribe("tag", "info"),
+		                                  self.client.subscribe("mail", "info"),
+		                                  self.client.subscribe("note", "info"),
+		                                  self.client.subscribe("report", "info"),
+		                                  self.client.subscribe("support", "info"),
+		                                  self.client.subscribe("client", "web", "info"),
+		                                  self.client.subscribe("core", "nodes"),
+		                                  self.client.subscribe("tags", "tags"),
+		                                  self.client.subscribe("tags", "groups"),
+		                                  self.client.subscribe("core", "chars", "awake")).wait()
+		for subscription in subscriptions.errors:
+			self.get_error(subscription, False)
+		self.log_success(lambda: f"Subscribed to {len(subscriptions) - len(subscriptions.errors)}/{len(subscriptions)} resources")
+		
+	def on(self, *event: str, characters = None, room = None, puppeted: bool | None = None,
+	       prefix: str | tuple[str, ...] | None = None, pattern: str | re.Pattern | None = None,
+	       targets_bot: bool | None = None, timeout: float | None = None):
+		"""
+		Register a handler for the given event types, only called for events that pass every filter.
+		
+		The handler may be a coroutine function. It runs alongside the other handlers, so a slow one
+		never holds up the rest, for at most timeout seconds (HandlerRunner.timeout by default). A
+		plain function is given one character's events one at a time, in the order they arrived.
+		
+		characters is a Character or id (or any number of them) the event has to come from, room a
+		Room or id it has to happen in, puppeted whether it has to (True) or must not (False) come
+		from a puppet, prefix and pattern what its message has to start with or contain (a regex),
+		and targets_bot whether it has to (True) or must not (False) be aimed at the bot.
+		"""
+		
 		def decorator(func):
+			handler = Handler(func, characters, room, puppeted, prefix, pattern, targets_bot, timeout)
 			for e in event:
 				if e not in self.on_calls:
-					self.log_error(f"Unknown event type - {e}")
+					self.log_error(lambda: f"Unknown event type - {e}")
 					continue
 				if func in self.on_calls[e]:
-					self.log_error(f"Function already registered - {func}")
+					self.log_error(lambda: f"Function already registered - {func}")
 					continue
-				self.on_calls[e].append(func)
+				self.on_calls[e].add(handler)
+			return func
 		
 		return decorator
 	
+	def event_room(self, event: EventBase) -> str | None:
+		# the id of the room an event happened in, from the cache only, so it never blocks
+		data = self.client.cache.data
+		# the character's own room if it is known, otherwise the bot's, which is where it hears everything
+		for rid in (f"core.char.{event.event.character.id}", f"core.char.{self.id}.owned", f"core.char.{self.id}"):
+			room = data.get(rid, {}).get("inRoom")
+			if type(room) is dict and "rid" in room:
+				return room["rid"].split(".")[2]
+		return None
+	
+	def decode_event(self, message: dict, log: bool = True) -> EventBase | None:
+		# the event a message carries, None if it is not one the bot handles (or it is the bot's own)
+		received_data = message
+		
+		if "id" in received_data:
+			return None
+		
+		if "data" not in received_data:
+			if log:
+				self.log_error(lambda: f"Error - No Data - {received_data}")
+			return None
+		
+		if "event" not in received_data:
+			if log:
+				self.log_error(lambda: f"Error - No Event - {received_data}")
+			return None
+		
+		if "type" not in received_data["data"]:
+			return None
+		
+		data = received_data["data"]
+		
+		if "targets" in data and log:
+			self.log_info(lambda: f"Recieved multiple targets - {data.get('targets')}")
+		
+		# now we want to convert the dictionary into its own nested classes
+		# create a new EventBase object
+		event = EventBase(id = data.get("id"), type = data.get("type"),
+		                  time = data.get("time"), sig = data.get("sig"))
+		
+		# now we want to work out what type of event it is
+		if event.type not in self.on_calls:
+			if log:
+				self.log_error(lambda: f"Unknown event type - {event.type}")
+			return None
+		
+		# decode the event with the decoder for its type
+		decode = self.decoders.get(event.type)
+		if decode is None:
+			if log:
+				self.log_error(lambda: f"Error - No decoder for event type - {event.type}")
+			return None
+		event.event = decode(self, data)
+		
+		# check if the character is the bot
+		if event.event.character.id == self.id:
+			return None
+		return event
+	
+	def intercept(self, message: dict) -> bool:
+		"""
+		Hand a reply to the wait_for waiting on it, returns whether one took it.
+		
+		Called by the client on the receiving thread, before the message is queued for the dispatch
+		workers. A handler blocked in wait_for holds up the worker the reply would be queued on, so
+		the reply has to be taken before it gets there.
+		"""
+		if not self.waiters.waiters:
+			return False
+		event = self.decode_event(message, log = False)
+		# TargetedCharacterEvents have no message
+		if event is None or type(event.event) is TargetedCharacterEvent:
+			return False
+		return self.waiters.offer(event.event.character.id, event)
+	
 	def boot(self):
+		self.client.intercept = self.intercept
+		
 		@self.client.on("message")
 		def on_message(message: dict):
-			received_data = message
-			
-			if "id" in received_data:
-				return
-			
-			if "data" not in received_data:
-				self.log_error(f"Error - No Data - {received_data}")
-				return
-			
-			if "event" not in received_data:
-				self.log_error(f"Error - No Event - {received_data}")
-				return
-			
-			if "type" not in received_data["data"]:
-				return
-			
-			data = received_data["data"]
-			
-			if "targets" in data:
-				self.log_info(f"Recieved multiple targets - {data.get('targets')}")
-			
-			# now we want to convert the dictionary into its own nested classes
-			# create a new EventBase object
-			event = EventBase(id = data.get("id"), type = data.get("type"),
-			                  time = data.get("time"), sig = data.get("sig"))
-			
-			# now we want to work out what type of event it is
-			if event.type not in self.on_calls:
-				self.log_error(f"Unknown event type - {event.type}")
-				return
-			
-			# now we want to create the event object
-			event_class = self.match_types[event.type]
-			
-			if event_class == CharacterMessageEvent:
-				event.event = CharacterMessageEvent(
-						character = Character(id = data.get("char", {}).get("id"),
-						                      bot = self),
-						message = data.get("msg"),
-						puppeteer = Character(id = data.get("puppeteer", {}).get("id"),
-						                      bot = self))
-			
-			elif event_class == CharacterPoseableMessageEvent:
-				event.event = CharacterPoseableMessageEvent(
-						character = Character(id = data.get("char", {}).get("id"),
-						                      bot = self),
-						message = data.get("msg"),
-						pose = data.get("pose"),
-						puppeteer = Character(id = data.get("puppeteer", {}).get("id"),
-						                      bot = self))
-			
-			elif event_class == TargetedCharacterMessageEvent:
-				event.event = TargetedCharacterMessageEvent(
-						character = Character(id = data.get("char", {}).get("id"),
-						                      bot = self),
-						
-						message = data.get("msg"),
-						target = Character(id = data.get("target", {}).get("id"),
-						                   bot = self),
-						ooc = data.get("ooc"),
-						pose = data.get("pose"),
-						puppeteer = Character(id = data.get("puppeteer", {}).get("id"),
-						                      bot = self),
-						targets = [Character(id = target.get("id"),
-						                     bot = self) for target in data.get("targets", [])])
-			
-			elif event_class == TargetRoomMessageEvent:
-				event.event = TargetRoomMessageEvent(
-						character = Character(id = data.get("char", {}).get("id"),
-						                      bot = self),
-						message = data.get("msg"),
-						target_room = Room(data.get("targetRoom", {}).get("name"),
-						                   data.get("targetRoom", {}).get("id")),
-						puppeteer = Character(id = data.get("puppeteer", {}).get("id"),
-						                      bot = self))
-			
-			elif event_class == TargetedCharacterEvent:
-				event.event = TargetedCharacterEvent(
-						character = Character(id = data.get("char", {}).get("id"),
-						                      bot = self),
-						target = Character(id = data.get("target", {}).get("id"),
-						                   bot = self),
-						puppeteer = Character(id = data.get("puppeteer", {}).get("id"),
-						                      bot = self))
-			
-			else:
-				self.log_error(f"Error - Unknown Event Class - {event_class}")
-				return
-			
-			# check if the character is the bot
-			if event.event.character.id == self.id:
+			event = self.decode_event(message)
+			if event is None:
 				return
 			
-			# check if the character.id is in the self.waiting_for_response_from dictionary
-			if event.event.character.id in self.waiting_for_response_from:
-				# check the type is not a TargetedCharacterEvents
-				if event_class != TargetedCharacterEvent:
-					self.waiting_for_response_from[event.event.character.id] = event.event.message
-					# we want to return here as we don't want to call the on_calls
-					return
-			
-			# checks for character privacy commands (e.g. !get local cache)
+			# "!" commands, such as the character privacy commands (e.g. !get local cache)
 			if self.built_in_methods(event):
 				return
 			
-			for func in self.on_calls[event.type]:
-				func(event)
+			# a character's events are handled one at a time and in order, other characters' alongside them
+			for handler in self.on_calls[event.type].select(event, self.id, self.event_room):
+				self.runner.run(handler.func, event, timeout = handler.timeout, key = event.event.character.id)
 		
 		@self.client.on("open")
 		def on_open():
 			self.log_info("Connection opened")
-			
-			# protocol version
-			self.version = self.get_version()
-			
-			# authenticate
-			self.authenticate()
-			
-			# get the bot
-			self.get_bot()
-			
-			# subscribe to all required resources
-			self.subscribe_to_all()
-			
-			# control the bot
-			self.control_bot()
-			
-			# wake up the bot
-			self.wake_up()
-			
-			self.booted = True
+			self.ready.clear()
+			graph = self.boot_graph()
+			self.booted = graph.run(self.boot_timeout)
+			self.boot_times = graph.times()
+			self.boot_duration = graph.duration
+			if self.booted:
+				self.boots += 1
+				self.log_success(lambda: f"Booted in {graph.duration * 1000:.0f}ms - " + ", ".join(
+						f"{name} {times['duration'] * 1000:.0f}ms" for name, times in self.boot_times.items()))
+			elif self.boots and self.client.reconnect and not self.client.closing:
+				# the handshake failed after a reconnect, drop the connection and run it again on the next one
+				self.log_error("Failed to boot, reconnecting")
+				self.client.drop()
+				return
+			else:
+				# the first boot failed (such as with a bad token), so boot() returns with booted False
+				self.log_error("Failed to boot, closing the connection")
+				if not self.client.closing:
+					self.client.close()
+			self.ready.set()
 		
 		# connect to the server
 		if not self.client.running:
 			self.client.connect()
+		# coroutine handlers share the client's event loop if it has one
+		if getattr(self.client, "loop", None) is not None:
+			self.runner.loop = self.client.loop
 		
-		while not self.booted:
-			time.sleep(0.1)
+		self.ready.wait()
 	
-	def built_in_methods(self, event: EventBase) -> bool:
-		# check to make sure the event has a message
-		if type(event.event) == TargetedCharacterEvent:
-			return False
-		# get the message
-		message = event.event.message
-		if message[0] != "!":
-			return False
-		# split the message into its context
-		method = message.lower().strip()
-		if method == "!get local cache":
-			event.event.character.message(f"{event.event.character.local_storage}")
-			return True
-		elif method == "!revoke local cache":
-			event.event.character.local_storage.clear()
-			if event.event.character.local_storage.data == {}:
-				event.event.character.message("Successfully revoked local cache")
-			else:
-				event.event.character.message("Failed to revoke local cache")
-			return True
-		else:
-			return False
+	def boot_graph(self) -> BootGraph:
+		"""
+		The steps run each time the connection opens, and what each has to wait for.
+		
+		The protocol version has to be the first request the gateway sees, so authentication waits
+		for it. Once authenticated the subscriptions and getting the bot are in flight at once; only
+		controlling the bot has to wait for its id, and waking it up and resuming the old
+		connection's requests for control.
+		"""
+		graph = BootGraph()
+		graph.add("version", lambda: setattr(self, "version", self.get_version()))
+		graph.add("authenticate", self.authenticate, after = ("version",))
+		graph.add("get_bot", self.get_bot, after = ("authenticate",))
+		graph.add("subscribe", self.subscribe_to_all, after = ("authenticate",))
+		graph.add("control", self.control_bot, after = ("get_bot",))
+		graph.add("wake_up", self.wake_up, after = ("control",))
+		# after a reconnect, restore the subscriptions and requests the old connection had
+		graph.add("resume", self.client.resume, after = ("control",))
+		return graph
+	
+	def command(self, name: str | None = None, args: dict | None = None, events: tuple[str, ...] | None = None,
+	            pattern: str | re.Pattern | None = None, flags: int = re.IGNORECASE):
+		"""
+		Register a "!" command, named after the function unless a name is given.
+		
+		The function is called with the event and the command's arguments, parsed with args (a dict
+		of argument name: type) or otherwise the function's annotations. With a pattern the function
+		is instead called with the event and the re.Match for any message the pattern is found in.
+		events limits the command to those event types, it is accepted from any message otherwise.
+		"""
 		
+		def decorator(func):
+			if pattern is not None:
+				self.commands.add_pattern(pattern, func, events, flags)
+			else:
+				self.commands.add((name or func.__name__).replace("_", " "), func, args, events)
+			return func
 		
+		return decorator
+	
+	def built_in_methods(self, event: EventBase) -> bool:
+		# run the command the message is for, if it is one
+		return self.commands.dispatch(event, lambda func, *args: self.runner.run(func, *args,
+		                                                                        key = event.event.character.id))
+	
+	def get_local_cache(self, event: EventBase) -> None:
+		event.event.character.message(f"{event.event.character.local_storage}")
+	
+	def revoke_local_cache(self, event: EventBase) -> None:
+		event.event.character.local_storage.clear()
+		if event.event.character.local_storage.data == {}:
+			event.event.character.message("Successfully revoked local cache")
+		else:
+			event.event.character.message("Failed to revoke local cache")
 	
 	def wake_up(self) -> None:
 		self.log_info("Waking up bot")
@@ -353,32 +418,32 @@ class Bot:
 	
 	def say(self, message: any) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.say","params":{"msg":"message"}}
-		self.log_info(f"Bot says - \"{str(message)}\"")
+		self.log_info(lambda: f"Bot says - \"{str(message)}\"")
 		return self.client.call("core", "char", self.id, "ctrl", "say",
 		                        msg = str(message)).send()
 	
 	def pose(self, message: any) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.pose","params":{"msg":"message"}}
-		self.log_info(f"Bot poses - \"{str(message)}\"")
+		self.log_info(lambda: f"Bot poses - \"{str(message)}\"")
 		return self.client.call("core", "char", self.id, "ctrl", "pose",
 		                        msg = str(message)).send()
 	
 	def ooc(self, message: any) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.ooc","params":{"msg":"message"}}
-		self.log_info(f"Bot oocs - \"{str(message)}\"")
+		self.log_info(lambda: f"Bot oocs - \"{str(message)}\"")
 		return self.client.call("core", "char", self.id, "ctrl", "ooc",
 		                        msg = str(message)).send()
 	
 	def describe(self, message: any) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.describe","params":{"msg":"message"}}
-		self.log_info(f"Bot describes - \"{str(message)}\"")
+		self.log_info(lambda: f"Bot describes - \"{str(message)}\"")
 		return self.client.call("core", "char", self.id, "ctrl", "describe",
 		                        msg = str(message)).send()
 	
 	def message(self, target: Character, message: any, pose: bool = False, ooc: bool = False) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.message",
 		# "params":{"charId":"{target_id}","msg":"hiya","pose":false, "ooc":false}}
-		self.log_info(f"Bot messages - {target.full_name} with \"{str(message)}\"")
+		self.log_info(lambda: f"Bot messages - {target.full_name} with \"{str(message)}\"")
 		return self.client.call("core", "char", self.id, "ctrl", "message",
 		                        charId = target.id,
 		                        msg = str(message),
@@ -388,7 +453,7 @@ class Bot:
 	def address(self, target: Character, message: any, pose: bool = False, ooc: bool = False) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.address",
 		# "params":{"charId":"{target_id}","msg":"hiya","pose":false,"ooc":false}}
-		self.log_info(f"Bot addresses - {target.full_name} with \"{str(message)}\"")
+		self.log_info(lambda: f"Bot addresses - {target.full_name} with \"{str(message)}\"")
 		return self.client.call("core", "char", self.id, "ctrl", "address",
 		                        charId = target.id,
 		                        msg = str(message),
@@ -398,7 +463,7 @@ class Bot:
 	def whisper(self, target: Character, message: any, pose: bool = False, ooc: bool = False) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.whisper",
 		# "params":{"charId":"{target_id}","msg":"hiya","pose":false,"ooc":false}}
-		self.log_info(f"Bot whispers - {target.full_name} with \"{str(message)}\"")
+		self.log_info(lambda: f"Bot whispers - {target.full_name} with \"{str(message)}\"")
 		return self.client.call("core", "char", self.id, "ctrl", "whisper",
 		                        charId = target.id,
 		                        msg = str(message),
@@ -415,86 +480,110 @@ class Bot:
 	def summon(self, target: Character) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.summon",
 		# "params":{"charId": "{target_id}"}}
-		self.log_info(f"Bot summons - {target.full_name}")
+		self.log_info(lambda: f"Bot summons - {target.full_name}")
 		return self.client.call("core", "char", self.id, "ctrl", "summon",
 		                        charId = target.id).send()
 	
 	def join(self, target: Character) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.join",
 		# "params":{"charId":"{target_id}"}}
-		self.log_info(f"Bot joins - {target.full_name}")
+		self.log_info(lambda: f"Bot joins - {target.full_name}")
 		return self.client.call("core", "char", self.id, "ctrl", "join",
 		                        charId = target.id).send()
 	
 	def lead(self, target: Character):
 		# {"id":0,"method":"call.core.char.{id}.ctrl.lead",
 		# "params":{"charId":"{target_id}"}}
-		self.log_info(f"Bot leads - {target.full_name}")
+		self.log_info(lambda: f"Bot leads - {target.full_name}")
 		return self.client.call("core", "char", self.id, "ctrl", "lead",
 		                        charId = target.id).send()
 
 	def follow(self, target: Character):
 		# {"id":0,"method":"call.core.char.{id}.ctrl.follow",
 		# "params":{"charId":"{target_id}"}}
-		self.log_info(f"Bot follows - {target.full_name}")
+		self.log_info(lambda: f"Bot follows - {target.full_name}")
 		return self.client.call("core", "char", self.id, "ctrl", "follow",
 		                        charId = target.id).send()
 	
 	def stop_lead(self, target: Character):
 		# {"id":0,"method":"call.core.char.{id}.ctrl.stopLead",
 		# "params":{"charId":"{target_id}"}}
-		self.log_info(f"Bot stops leading - {target.full_name}")
+		self.log_info(lambda: f"Bot stops leading - {target.full_name}")
 		return self.client.call("core", "char", self.id, "ctrl", "stopLead",
 		                        charId = target.id).send()
 
 	def stop_follow(self):
 		# {"id":0,"method":"call.core.char.{id}.ctrl.stopFollow",
 		# "params":{}}
-		self.log_info(f"Bot stops following")
+		self.log_info(lambda: "Bot stops following")
 		return self.client.call("core", "char", self.id, "ctrl", "stopFollow").send()
 	
 	def sleep(self) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.release","params":{}}
-		self.log_info("Bot sleeps")
+		self.log_info(lambda: "Bot sleeps")
 		return self.client.call("core", "char", self.id, "ctrl", "release").send()
 	
 	def ping(self) -> Request:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.ping","params":{}}
-		self.log_info("Bot pings")
+		self.log_info(lambda: "Bot pings")
 		return self.client.call("core", "char", self.id, "ctrl", "ping").send()
 	
-	def wait_for(self, character: Character, timeout: int = 10) -> str:
-		# check if we're already waiting for a response from this character
-		if character.id in self.waiting_for_response_from:
-			self.log_error(f"Error: Bot Already Awaiting Response - {character.full_name}")
+	def reply_predicate(self, room: Room | None = None, pattern: str | re.Pattern | None = None, predicate = None):
+		# combine the wait_for conditions into one check of an EventBase, None if there are none.
+		# it runs on the receiving thread, so it only reads the cache and never waits on the gateway
+		if room is None and pattern is None and predicate is None:
+			return None
+		if type(pattern) is str:
+			pattern = re.compile(pattern)
+		room = getattr(room, "id", room)
+		
+		def matches(event: EventBase) -> bool:
+			if pattern is not None and (event.event.message is None or not pattern.search(event.event.message)):
+				return False
+			if room is not None and self.event_room(event) != room:
+				return False
+			return predicate is None or predicate(event)
+		
+		return matches
+	
+	def wait_for(self, character: Character | None = None, timeout: float = 10, room: Room | None = None,
+	             pattern: str | re.Pattern | None = None, predicate = None) -> str:
+		"""
+		Wait for a character to reply, returning their message or "" if they did not within timeout seconds.
+		
+		The reply can be narrowed down to one in a given room, one matching a regex pattern, or one
+		a predicate (called with the EventBase) accepts; without a character any character's reply
+		counts. The reply is not passed on to the @bot.on handlers. Any number of waits can be pending
+		at once, and none of them use any CPU while they wait. Replies are matched on the thread that
+		receives them, so a predicate should be quick and must not block.
+		"""
+		event = self.wait_for_event(character, timeout, room, pattern, predicate)
+		return "" if event is None else event.event.message
+	
+	def wait_for_event(self, character: Character | None = None, timeout: float = 10, room: Room | None = None,
+	                   pattern: str | re.Pattern | None = None, predicate = None) -> EventBase | None:
+		# like wait_for, but returns the whole event (or None)
+		event = self.waiters.wait(None if character is None else character.id,
+		                          self.reply_predicate(room, pattern, predicate), timeout)
+		if event is None:
+			self.log_info(lambda: f"Bot timed out waiting for a response from {character.full_name if character else 'anyone'}")
+		return event
+	
+	async def wait_for_async(self, character: Character | None = None, timeout: float = 10, room: Room | None = None,
+	                         pattern: str | re.Pattern | None = None, predicate = None) -> str:
+		# wait_for for coroutines, the event loop keeps running while it waits
+		event = await self.waiters.wait_async(None if character is None else character.id,
+		                                      self.reply_predicate(room, pattern, predicate), timeout)
+		if event is None:
+			self.log_info(lambda: f"Bot timed out waiting for a response from {character.full_name if character else 'anyone'}")
 			return ""
-		# add the character to the dict of characters we're waiting for a response from with value (the time)
-		self.waiting_for_response_from[character.id] = time.time()
-		# wait for a response from the character
-		while type(self.waiting_for_response_from[character.id]) != str:
-			# if the timeout is reached, return an empty string
-			try:
-				if time.time() - self.waiting_for_response_from[character.id] > timeout:
-					self.log_info(f"Bot timed out waiting for a response from {character.full_name}")
-					del self.waiting_for_response_from[character.id]
-					return ""
-			except TypeError:
-				# another thread has changed the value of the dict entry to a string
-				# this means we have a response from the character
-				pass
-		
-		# get the response from the character
-		response = self.waiting_for_response_from[character.id]
-		# remove the character from the dict of characters we're waiting for a response from
-		del self.waiting_for_response_from[character.id]
-		# return the response
-		return response
+		return event.event.message
 	
 	def look_up_characters(self, character_name: str) -> list[Character]:
 		# {"id":0,"method":"call.core.char.{id}.ctrl.lookUp",
 		# "params":{"name":"{character_name}"}}
 		names = character_name.split(" ")
-		self.log_info(f"Bot looking up characters with the name {names[0]}")
+		self.log_info(lambda: f"Bot looking up characters with the name {names[0]}")
 		characters = self.client.call(self.rid, "lookupChars",
 		                              name = names[0], extended = True).wait()
 		
@@ -511,21 +600,21 @@ class Bot:
 			
 			if len(names) > 1:
 				# filter out characters that don't have the second name
-				self.log_info(f"Bot found {len(characters)} characters with the name {character_name}")
+				self.log_info(lambda: f"Bot found {len(characters)} characters with the name {character_name}")
 				return [character for character in characters if
 				        character.surname.lower() == " ".join(names[1:]).lower()]
 			
 			else:
-				self.log_info(f"Bot found {len(characters)} characters with the name {character_name}")
+				self.log_info(lambda: f"Bot found {len(characters)} characters with the name {character_name}")
 				return characters
 		
 		else:
-			self.log_error(f"Error - Bot Failed To Look Up Characters - {character_name}")
+			self.log_error(lambda: f"Error - Bot Failed To Look Up Characters - {character_name}")
 			return []
 	
 	def use_exit(self, exit: Exit):
 		# {"id":0,"method":"call.core.char.{id}.ctrl.useExit","params":{"exitId":"{exit_id}"}}
-		self.log_info(f"Bot uses exit - {exit.name}")
+		self.log_info(lambda: f"Bot uses exit - {exit.name}")
 		self.client.call("core", "char", self.id, "ctrl", "useExit", exitId = exit.id).send()
 	
 	def get_room(self) -> Room:
@@ -535,6 +624,7 @@ class Bot:
 		self.log_info("Killing bot")
 		self.sleep()
 		self.client.close()
+		self.runner.close()
 		self.log_success("Successfully killed bot")
 		sys.exit()
 		
\ No newline at end of file
@@ -0,0 +1,69 @@
+import json
+
+
+class Codec:
+	"""
+	Encodes and decodes websocket frames.
+	
+	The base class uses the standard library json module, the subclasses wrap faster optional
+	backends that are used when they are installed.
+	"""
+	name = "json"
+	
+	def loads(self, data: str | bytes) -> any:
+		return json.loads(data)
+	
+	def dumps(self, value: any) -> str:
+		return json.dumps(value)
+	
+	def __repr__(self):
+		return f"{self.__class__.__name__}({self.name})"
+
+
+class OrjsonCodec(Codec):
+	name = "orjson"
+	
+	def __init__(self):
+		import orjson
+		self.orjson = orjson
+	
+	def loads(self, data: str | bytes) -> any:
+		return self.orjson.loads(data)
+	
+	def dumps(self, value: any) -> str:
+		# orjson produces bytes, text frames need a str
+		return self.orjson.dumps(value).decode()
+
+
+class UjsonCodec(Codec):
+	name = "ujson"
+	
+	def __init__(self):
+		import ujson
+		self.ujson = ujson
+	
+	def loads(self, data: str | bytes) -> any:
+		return self.ujson.loads(data)
+	
+	def dumps(self, value: any) -> str:
+		return self.ujson.dumps(value, ensure_ascii = False)
+
+
+codecs = {"orjson": OrjsonCodec,
+          "ujson" : UjsonCodec,
+          "json"  : Codec, }
+
+
+def get_codec(name: str | None = None) -> Codec:
+	# a named codec must be available, otherwise use the fastest one that is installed
+	if name is not None:
+		if name not in codecs:
+			raise ValueError(f"Unknown codec '{name}'. Supported codecs are: {', '.join(codecs)}")
+		return codecs[name]()
+	
+	for codec in codecs.values():
+		try:
+			return codec()
+		except ImportError:
+			continue
+	return Codec()
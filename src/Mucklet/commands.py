@@ -0,0 +1,160 @@
+import re
+
+
+class Command:
+	"""
+	A command, such as "!roll 20", with the schema its arguments are parsed with.
+	
+	args maps each argument name to the type (or any callable) that converts it from text. When
+	the last argument is a str it takes the rest of the message, spaces and all. Arguments with a
+	default in the handler's signature are optional.
+	"""
+	
+	__slots__ = ("name", "func", "args", "defaults", "events", "usage")
+	
+	def __init__(self, name: str, func, args: dict | None = None, events: tuple[str, ...] | None = None):
+		self.name = name
+		self.func = func
+		parameters = []
+		if args is None or args:
+			# inspect is only needed for commands that take arguments
+			import inspect
+			parameters = list(inspect.signature(func).parameters.values())[1:]
+		if args is None:
+			# take the schema from the handler's annotations, the first parameter is the event
+			args = {parameter.name: parameter.annotation
+			        if callable(parameter.annotation) and parameter.annotation is not parameter.empty else str
+			        for parameter in parameters if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD,
+			                                                          parameter.KEYWORD_ONLY)}
+		self.args = tuple(args.items())
+		self.defaults = {parameter.name: parameter.default for parameter in parameters
+		                 if parameter.default is not parameter.empty}
+		self.events = None if events is None else frozenset(events)
+		self.usage = " ".join([name] + [f"[{arg}]" if arg in self.defaults else f"<{arg}>" for arg, _ in self.args])
+	
+	def parse(self, text: str) -> list:
+		# the arguments for func in schema order, raises ValueError if text does not fit the schema
+		if not self.args:
+			if text.strip():
+				raise ValueError("too many arguments, expected none")
+			return []
+		rest = self.args[-1][1] is str
+		values = text.split(None, len(self.args) - 1) if rest else text.split()
+		if len(values) > len(self.args):
+			raise ValueError(f"too many arguments, expected {len(self.args)}")
+		parsed = []
+		for (name, kind), value in zip(self.args, values):
+			try:
+				parsed.append(kind(value))
+			except (TypeError, ValueError):
+				raise ValueError(f"{name} must be {getattr(kind, '__name__', kind)}, not {value!r}")
+		# arguments left out take the handler's defaults
+		for name, _ in self.args[len(values):]:
+			if name not in self.defaults:
+				raise ValueError(f"missing {name}")
+		return parsed
+
+
+class CommandRouter:
+	"""
+	Finds the command a message is for.
+	
+	Command names are kept in a trie of lowercase words ("get local cache" is three levels), so
+	finding the command costs a dictionary lookup per word whatever the number of commands. Regex
+	patterns are compiled once when they are added, and only tried for messages that are not a
+	command, in the order they were added.
+	"""
+	
+	# the key a trie node keeps its command under, words can never be None
+	leaf = None
+	
+	def __init__(self, prefix: str = "!"):
+		self.prefix = prefix
+		self.root = {}
+		# the most words in any command name, messages are split no further than this
+		self.depth = 0
+		self.patterns = []  # list[tuple[re.Pattern, func, frozenset | None]]
+	
+	def add(self, name: str, func, args: dict | None = None, events: tuple[str, ...] | None = None) -> Command:
+		command = Command(name, func, args, events)
+		words = name.lower().split()
+		node = self.root
+		for word in words:
+			node = node.setdefault(word, {})
+		node[CommandRouter.leaf] = command
+		self.depth = max(self.depth, len(words))
+		return command
+	
+	def add_pattern(self, pattern: str | re.Pattern, func, events: tuple[str, ...] | None = None,
+	                flags: int = 0) -> re.Pattern:
+		compiled = re.compile(pattern, flags) if type(pattern) is str else pattern
+		self.patterns.append((compiled, func, None if events is None else frozenset(events)))
+		return compiled
+	
+	def remove(self, name: str) -> None:
+		node = self.root
+		for word in name.lower().split():
+			node = node.get(word)
+			if node is None:
+				return
+		node.pop(CommandRouter.leaf, None)
+	
+	def find(self, message: str) -> tuple[Command | None, str]:
+		# the command the message is for and the text after its name, (None, "") if there is none
+		if not message.startswith(self.prefix):
+			return None, ""
+		body = message[len(self.prefix):]
+		node = self.root
+		found, length = None, 0
+		for index, word in enumerate(body.split(None, self.depth)[:self.depth]):
+			node = node.get(word.lower())
+			if node is None:
+				break
+			if CommandRouter.leaf in node:
+				# the longest name wins, so "get local cache" is found before a "get" command
+				found, length = node[CommandRouter.leaf], index + 1
+		if found is None:
+			return None, ""
+		parts = body.split(None, length)
+		return found, parts[length] if len(parts) > length else ""
+	
+	def dispatch(self, event: "EventBase", run) -> bool:
+		"""
+		Run the command or pattern handler the event's message is for, returns whether there was one.
+		
+		Handlers are called through run(func, *args), command handlers with the event and their
+		parsed arguments, pattern handlers with the event and the match. A command whose arguments
+		do not fit its schema is answered with its usage instead.
+		"""
+		message = getattr(event.event, "message", None)
+		if not message:
+			return False
+		command, rest = self.find(message)
+		if command is not None and (command.events is None or event.type in command.events):
+			try:
+				arguments = command.parse(rest)
+			except ValueError as error:
+				event.event.character.message(f"{error} - usage: {self.prefix}{command.usage}")
+				return True
+			run(command.func, event, *arguments)
+			return True
+		for pattern, func, events in self.patterns:
+			if events is not None and event.type not in events:
+				continue
+			match = pattern.search(message)
+			if match is not None:
+				run(func, event, match)
+				return True
+		return False
+	
+	def commands(self) -> list[Command]:
+		found = []
+		nodes = [self.root]
+		while nodes:
+			node = nodes.pop()
+			for word, child in node.items():
+				if word is CommandRouter.leaf:
+					found.append(child)
+				else:
+					nodes.append(child)
+		return sorted(found, key = lambda command: command.name)
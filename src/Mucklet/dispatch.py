@@ -0,0 +1,102 @@
+import itertools
+import queue
+import threading
+import time
+import traceback
+from .log import ERROR
+from .log import Logger
+
+
+class Dispatcher:
+	"""
+	A fixed pool of worker threads that run event handlers.
+	
+	Every worker owns a bounded queue, and work submitted with the same key always goes to the
+	same worker, so events for one room (and so for each character in it) are handled in the order
+	they arrived. Work without a key is spread round-robin across the workers. Once closed, the work
+	already queued is finished and anything submitted after is dropped.
+	"""
+	
+	def __init__(self, workers: int = 4, queue_size: int = 1000, put_timeout: float = 5):
+		self.workers = max(1, workers)
+		self.queue_size = queue_size
+		self.put_timeout = put_timeout
+		self.queues = [queue.Queue(maxsize = queue_size) for _ in range(self.workers)]
+		self.threads = []
+		self.next_worker = itertools.count()
+		self.lock = threading.Lock()
+		self.closed = False
+		self.dropped = 0
+		self.log_error = Logger(format_color = (210, 80, 80), bold = False, level = ERROR)
+	
+	def start(self) -> None:
+		with self.lock:
+			if self.threads or self.closed:
+				return
+			for index, work in enumerate(self.queues):
+				thread = threading.Thread(target = self.run, args = (work,),
+				                          name = f"Mucklet-dispatch-{index}", daemon = True)
+				thread.start()
+				self.threads.append(thread)
+	
+	def submit(self, key: any, func, *args) -> bool:
+		if not self.threads:
+			if self.closed:
+				return False
+			self.start()
+		if key is None:
+			index = next(self.next_worker) % self.workers
+		else:
+			index = hash(key) % self.workers
+		try:
+			# block for a while when the worker is backed up, the receiving thread is throttled instead of
+			# letting the queue grow without limit
+			self.queues[index].put((func, args), timeout = self.put_timeout)
+		except queue.Full:
+			self.dropped += 1
+			self.log_error(f"Dispatch queue {index} is full, dropped {getattr(func, '__name__', func)} ({self.dropped} dropped)", False)
+			return False
+		return True
+	
+	def run(self, work: queue.Queue) -> None:
+		while True:
+			item = work.get()
+			if item is None:
+				work.task_done()
+				return
+			func, args = item
+			try:
+				func(*args)
+			except Exception:
+				self.log_error(f"Error in {getattr(func, '__name__', func)}:\n{traceback.format_exc()}", False)
+			finally:
+				# only counted as done once it has run, not when it was taken off the queue
+				work.task_done()
+	
+	def wait_idle(self, timeout: float | None = None) -> bool:
+		# wait until everything submitted so far has finished running, returns False if timeout ran out first
+		deadline = None if timeout is None else time.monotonic() + timeout
+		for work in self.queues:
+			with work.all_tasks_done:
+				while work.unfinished_tasks:
+					remaining = None if deadline is None else deadline - time.monotonic()
+					if remaining is not None and remaining <= 0:
+						return False
+					work.all_tasks_done.wait(remaining)
+		return True
+	
+	@property
+	def depth(self) -> int:
+		return sum(work.qsize() for work in self.queues)
+	
+	@property
+	def depths(self) -> list[int]:
+		return [work.qsize() for work in self.queues]
+	
+	def close(self) -> None:
+		with self.lock:
+			self.closed = True
+			# each worker stops once it reaches the end of the work queued before this
+			for work in self.queues if self.threads else ():
+				work.put(None)
+			self.threads = []
@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import fnmatch
+import random
+import string
+import threading
+import time
+from .codec import get_codec
+from .log import Logger
+
+
+class GatewayError(Exception):
+	def __init__(self, code: str, message: str):
+		super().__init__(message)
+		self.code = code
+		self.message = message
+
+
+class Gateway:
+	"""
+	A local stand-in for the Mucklet RES gateway, for testing and benchmarking without the live service.
+	
+	It speaks enough of the protocol for ResClient and Bot.boot: version, auth.auth.authenticateBot,
+	call.core.getBot, subscribe, unsubscribe and get, controlChar and the ctrl calls, and sends change,
+	add and remove events for the resources a connection has subscribed to. The world is a dict of
+	models and a dict of collections, and can be filled with populate() or set up by hand:
+		
+		gateway = Gateway().start()
+		gateway.populate(characters = 100, rooms = 10)
+		bot = Bot(gateway.token, ResClient(gateway.url, gateway.origin))
+		bot.boot()
+		gateway.flood(10000)
+	
+	Every method may be called from any thread. Extra methods can be handled with handle().
+	"""
+	
+	# the resources Bot.boot subscribes to
+	models = ("core.info", "tag.info", "mail.info", "note.info", "report.info", "support.info", "client.web.info")
+	collections = ("core.nodes", "tags.tags", "tags.groups", "core.chars.awake")
+	chat = ("say", "pose", "ooc", "describe")
+	
+	def __init__(self, host: str = "127.0.0.1", port: int = 0, token: str = "test-token",
+	             bot_name: str = "Test", bot_surname: str = "Bot", codec: str | None = None):
+		self.host = host
+		self.port = port
+		self.token = token
+		self.origin = f"http://{host}"
+		self.codec = get_codec(codec)
+		self.data = {rid: {} for rid in Gateway.models}
+		self.data.update({rid: [] for rid in Gateway.collections})
+		self.lock = threading.RLock()
+		# websocket: set of rids it is subscribed to
+		self.connections = {}
+		self.authenticated = set()
+		# websocket: frames waiting to be written by its writer
+		self.outboxes = {}
+		self.wakeups = {}
+		# (pattern, handler) checked in order before the built in methods
+		self.handlers = []
+		self.requests = 0
+		self.events = 0
+		self.loop = None
+		self.server = None
+		self.thread = None
+		self.log_info = Logger(format_color = (80, 80, 210), bold = False)
+		
+		self.bot_id = self.add_character(bot_name, surname = bot_surname)
+		self.data[f"core.bot.{self.bot_id}"] = {"id": self.bot_id, "char": {"rid": f"core.char.{self.bot_id}"}}
+	
+	@property
+	def url(self) -> str:
+		return f"ws://{self.host}:{self.port}"
+	
+	@staticmethod
+	def new_id() -> str:
+		return "".join(random.choices(string.ascii_lowercase + string.digits, k = 20))
+	
+	# world state
+	
+	def add_character(self, name: str, surname: str = "", **values) -> str:
+		id = values.pop("id", None) or Gateway.new_id()
+		with self.lock:
+			self.data[f"core.char.{id}"] = {"id"     : id,
+			                                "name"   : name,
+			                                "surname": surname,
+			                                "species": "Test",
+			                                "gender" : "Other",
+			                                "awake"  : False,
+			                                "state"  : "asleep",
+			                                "idle"   : 0,
+			                                "tags"   : [],
+			                                **values, }
+		return id
+	
+	def add_room(self, name: str, **values) -> str:
+		id = values.pop("id", None) or Gateway.new_id()
+		with self.lock:
+			self.data[f"core.room.{id}.chars"] = []
+			self.data[f"core.room.{id}.exits"] = []
+			self.data[f"core.room.{id}.details"] = {"id"   : id,
+			                                        "name" : name,
+			                                        "desc" : "",
+			                                        "chars": {"rid": f"core.room.{id}.chars"},
+			                                        "exits": {"rid": f"core.room.{id}.exits"},
+			                                        **values, }
+		return id
+	
+	def enter(self, char_id: str, room_id: str) -> None:
+		# move a character into a room, sending the add event to anyone watching the room
+		self.add(f"core.room.{room_id}.chars", -1, {"rid": f"core.char.{char_id}"})
+		self.change(f"core.char.{char_id}", inRoom = {"rid": f"core.room.{room_id}.details"})
+	
+	def populate(self, characters: int = 100, rooms: int = 10, seed: int | None = None) -> list[str]:
+		# fill the world with synthetic rooms and characters, returns the character ids
+		generator = random.Random(seed)
+		room_ids = [self.add_room(f"Room {index}") for index in range(max(1, rooms))]
+		char_ids = []
+		for index in range(characters):
+			id = self.add_character(f"Character{index}", surname = f"Test{index}", awake = generator.random() < 0.5)
+			self.enter(id, generator.choice(room_ids))
+			char_ids.append(id)
+		self.enter(self.bot_id, room_ids[0])
+		return char_ids
+	
+	def set(self, rid: str, value: dict | list) -> None:
+		with self.lock:
+			self.data[rid] = value
+	
+	def change(self, rid: str, **values) -> None:
+		with self.lock:
+			self.data.setdefault(rid, {}).update(values)
+		self.send_event(f"{rid}.change", {"values": values}, rid)
+	
+	def add(self, rid: str, idx: int, value: any) -> None:
+		with self.lock:
+			collection = self.data.setdefault(rid, [])
+			idx = len(collection) if idx < 0 else idx
+			collection.insert(idx, value)
+		self.send_event(f"{rid}.add", {"idx": idx, "value": value}, rid)
+	
+	def remove(self, rid: str, idx: int) -> None:
+		with self.lock:
+			self.data[rid].pop(idx)
+		self.send_event(f"{rid}.remove", {"idx": idx}, rid)
+	
+	def message(self, char_id: str, type: str = "say", msg: str = "", **values) -> None:
+		# a character does something, sent to every connection as the bot's out event
+		char = self.data.get(f"core.char.{char_id}", {})
+		data = {"id"  : Gateway.new_id(),
+		        "type": type,
+		        "char": {"id": char_id, "name": char.get("name"), "surname": char.get("surname")},
+		        "msg" : msg,
+		        "time": int(time.time() * 1000),
+		        "sig" : Gateway.new_id(),
+		        **values, }
+		self.send_event(f"core.char.{self.bot_id}.out", data)
+	
+	def flood(self, count: int, types: tuple[str, ...] = ("say", "pose"), characters: list[str] | None = None,
+	          rate: float | None = None, changes: float = 0.2) -> None:
+		"""
+		Send count synthetic events from random characters.
+		
+		Roughly changes of them are model changes (a character going idle) rather than messages. If rate
+		is set the events are spread out to rate per second, otherwise they are sent as fast as possible.
+		Blocks until every event has been queued.
+		"""
+		with self.lock:
+			characters = characters or [rid[len("core.char."):] for rid in self.data
+			                            if rid.startswith("core.char.") and rid.count(".") == 2
+			                            and rid != f"core.char.{self.bot_id}"]
+		if not characters:
+			characters = [self.add_character("Flood", surname = "Character")]
+		for index in range(count):
+			char_id = random.choice(characters)
+			if random.random() < changes:
+				self.change(f"core.char.{char_id}", idle = index)
+			else:
+				self.message(char_id, random.choice(types), f"Message {index}")
+			if rate:
+				time.sleep(1 / rate)
+	
+	# requests
+	
+	def handle(self, pattern: str):
+		"""
+		Register a handler for requests whose method matches pattern (fnmatch, e.g. "call.core.char.*.ctrl.lookupChars").
+		
+		The handler is called with (method, params) and returns the result, or raises GatewayError.
+		"""
+		def decorator(func):
+			self.handlers.insert(0, (pattern, func))
+			return func
+		
+		return decorator
+	
+	def resources(self, rid: str, models: dict, collections: dict) -> None:
+		# add rid and everything it references to the response
+		if rid in models or rid in collections:
+			return
+		value = self.data.get(rid)
+		if value is None:
+			return
+		(collections if type(value) is list else models)[rid] = value
+		for item in (value if type(value) is list else value.values()):
+			if type(item) is dict and "rid" in item:
+				self.resources(item["rid"], models, collections)
+	
+	def subscribed(self, rid: str) -> dict:
+		if rid not in self.data:
+			raise GatewayError("system.notFound", f"Resource {rid} not found")
+		models, collections = {}, {}
+		with self.lock:
+			self.resources(rid, models, collections)
+		result = {}
+		if models:
+			result["models"] = models
+		if collections:
+			result["collections"] = collections
+		return result
+	
+	def call(self, ws, method: str, params: dict) -> any:
+		for pattern, handler in self.handlers:
+			if fnmatch.fnmatchcase(method, pattern):
+				return handler(method, params)
+		
+		kind, _, rid = method.partition(".")
+		if kind == "version":
+			return {"protocol": "1.2.1"}
+		if kind == "auth":
+			if rid != "auth.authenticateBot":
+				raise GatewayError("system.methodNotFound", f"Method {method} not found")
+			if params.get("token") != self.token:
+				raise GatewayError("system.accessDenied", "Invalid token")
+			self.authenticated.add(ws)
+			return {"payload": None}
+		if kind in ("subscribe", "get"):
+			result = self.subscribed(rid)
+			if kind == "subscribe":
+				self.connections[ws].update(result.get("models", {}), result.get("collections", {}))
+			return result
+		if kind == "unsubscribe":
+			self.connections[ws].discard(rid)
+			return {"payload": None}
+		if kind != "call":
+			raise GatewayError("system.invalidRequest", f"Invalid request method {method}")
+		if ws not in self.authenticated:
+			raise GatewayError("system.accessDenied", "Not authenticated")
+		
+		rid, _, action = rid.rpartition(".")
+		if rid == "core" and action == "getBot":
+			return {"rid": f"core.bot.{self.bot_id}", **self.subscribed(f"core.bot.{self.bot_id}")}
+		if rid.startswith("core.bot.") and action == "controlChar":
+			return {"payload": None}
+		if rid.startswith("core.char.") and rid.endswith(".ctrl"):
+			char_id = rid.split(".")[2]
+			if action in Gateway.chat:
+				self.message(char_id, action, params.get("msg", ""))
+			elif action in ("wakeup", "sleep"):
+				awake = action == "wakeup"
+				self.change(f"core.char.{char_id}", awake = awake, state = "awake" if awake else "asleep")
+			return {"payload": None}
+		raise GatewayError("system.methodNotFound", f"Method {method} not found")
+	
+	def respond(self, ws, request: dict) -> dict:
+		self.requests += 1
+		try:
+			result = self.call(ws, request.get("method", ""), request.get("params") or {})
+		except GatewayError as error:
+			return {"id": request.get("id"), "error": {"code": error.code, "message": error.message}}
+		return {"id": request.get("id"), "result": result}
+	
+	# connections
+	
+	def send_event(self, event: str, data: dict, rid: str | None = None) -> None:
+		# send to every connection subscribed to rid, or to every connection when there is no rid
+		self.events += 1
+		frame = self.codec.dumps({"event": event, "data": data})
+		with self.lock:
+			targets = [ws for ws, rids in self.connections.items() if rid is None or rid in rids]
+		for ws in targets:
+			self.send(ws, frame)
+	
+	def send(self, ws, frame: str) -> None:
+		# frames are written in order by the connection's writer, which is only woken for the first
+		# frame queued since it last ran so a flood costs one wakeup per batch rather than per frame
+		with self.lock:
+			outbox = self.outboxes.get(ws)
+			if outbox is None:
+				return
+			outbox.append(frame)
+			if len(outbox) > 1:
+				return
+		self.loop.call_soon_threadsafe(self.wakeups[ws].set)
+	
+	async def write(self, ws) -> None:
+		wakeup = self.wakeups[ws]
+		while True:
+			await wakeup.wait()
+			wakeup.clear()
+			with self.lock:
+				frames, self.outboxes[ws] = self.outboxes[ws], []
+			for frame in frames:
+				await ws.send(frame)
+	
+	async def serve(self, ws, *args) -> None:
+		with self.lock:
+			self.connections[ws] = set()
+			self.outboxes[ws] = []
+			self.wakeups[ws] = asyncio.Event()
+		writer = self.loop.create_task(self.write(ws))
+		try:
+			async for frame in ws:
+				self.send(ws, self.codec.dumps(self.respond(ws, self.codec.loads(frame))))
+		except Exception:
+			pass
+		finally:
+			writer.cancel()
+			with self.lock:
+				self.connections.pop(ws, None)
+				self.outboxes.pop(ws, None)
+				self.wakeups.pop(ws, None)
+				self.authenticated.discard(ws)
+	
+	async def listen(self) -> None:
+		try:
+			import websockets
+		except ImportError:
+			raise ImportError("Gateway requires the 'websockets' package, "
+			                  "install it with 'pip install mucklet[async]'")
+		self.loop = asyncio.get_running_loop()
+		self.server = await websockets.serve(self.serve, self.host, self.port, close_timeout = 1)
+		self.port = self.server.sockets[0].getsockname()[1]
+		self.log_info(f"Gateway listening on {self.url}", False)
+	
+	def start(self) -> "Gateway":
+		# run the gateway on an event loop in a background thread
+		started = threading.Event()
+		errors = []
+		
+		def run():
+			loop = asyncio.new_event_loop()
+			try:
+				loop.run_until_complete(self.listen())
+			except Exception as error:
+				errors.append(error)
+				started.set()
+				return
+			started.set()
+			loop.run_forever()
+		
+		self.thread = threading.Thread(target = run, name = "Mucklet-gateway", daemon = True)
+		self.thread.start()
+		started.wait()
+		if errors:
+			raise errors[0]
+		return self
+	
+	def close(self) -> None:
+		if self.server is None:
+			return
+		
+		async def stop():
+			self.server.close()
+			await self.server.wait_closed()
+		
+		asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.server = None
+	
+	def disconnect(self) -> None:
+		# drop every connection, the clients see the connection as lost
+		with self.lock:
+			connections = list(self.connections)
+		for ws in connections:
+			asyncio.run_coroutine_threadsafe(ws.close(), self.loop)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description = "Run a local stand-in for the Mucklet gateway.")
+	parser.add_argument("--host", default = "127.0.0.1")
+	parser.add_argument("--port", type = int, default = 8765)
+	parser.add_argument("--token", default = "test-token")
+	parser.add_argument("--characters", type = int, default = 100)
+	parser.add_argument("--rooms", type = int, default = 10)
+	parser.add_argument("--flood", type = int, default = 0, help = "events to send after the first connection")
+	parser.add_argument("--rate", type = float, default = None, help = "events per second when flooding")
+	arguments = parser.parse_args()
+	
+	gateway = Gateway(arguments.host, arguments.port, arguments.token).start()
+	gateway.populate(arguments.characters, arguments.rooms)
+	try:
+		while True:
+			time.sleep(1)
+			if arguments.flood and gateway.connections:
+				gateway.flood(arguments.flood, rate = arguments.rate)
+				arguments.flood = 0
+	except KeyboardInterrupt:
+		gateway.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,123 @@
+import itertools
+import re
+
+
+class Handler:
+	"""
+	An @bot.on handler and the filters an event has to pass for it to be called.
+	
+	Every filter is optional: characters (the ids the event has to be from), room (the id of the
+	room it has to happen in), puppeted (whether it has to, or must not, come from a puppet),
+	prefix and pattern (what its message has to start with or contain) and targets_bot (whether
+	it has to, or must not, be aimed at the bot). timeout is how long the handler may run for, the
+	runner's default if it is None.
+	"""
+	
+	__slots__ = ("func", "characters", "room", "puppeted", "prefix", "pattern", "targets_bot", "timeout", "order")
+	
+	counter = itertools.count()
+	
+	def __init__(self, func, characters = None, room = None, puppeted: bool | None = None,
+	             prefix: str | tuple[str, ...] | None = None, pattern: str | re.Pattern | None = None,
+	             targets_bot: bool | None = None, timeout: float | None = None):
+		self.func = func
+		if characters is not None:
+			# a single character or id, or any number of them
+			characters = (characters,) if type(characters) is str or hasattr(characters, "id") else characters
+			characters = frozenset(getattr(character, "id", character) for character in characters)
+		self.characters = characters
+		self.room = getattr(room, "id", room)
+		self.puppeted = puppeted
+		self.prefix = prefix
+		self.pattern = re.compile(pattern) if type(pattern) is str else pattern
+		self.targets_bot = targets_bot
+		self.timeout = timeout
+		# handlers found through different indexes are run in the order they were registered
+		self.order = next(Handler.counter)
+	
+	def matches(self, event: "EventBase", bot_id: str, room: str | None) -> bool:
+		# the filters the indexes have not already checked, the cheap ones first
+		data = event.event
+		if self.characters is not None and data.character.id not in self.characters:
+			return False
+		if self.room is not None and room != self.room:
+			return False
+		if self.puppeted is not None:
+			puppeteer = getattr(data, "puppeteer", None)
+			if (puppeteer is not None and puppeteer.id is not None) is not self.puppeted:
+				return False
+		if self.prefix is not None or self.pattern is not None:
+			message = getattr(data, "message", None)
+			if message is None:
+				return False
+			if self.prefix is not None and not message.startswith(self.prefix):
+				return False
+			if self.pattern is not None and self.pattern.search(message) is None:
+				return False
+		if self.targets_bot is not None:
+			targets = getattr(data, "targets", None)
+			if targets is None:
+				target = getattr(data, "target", None)
+				targets = () if target is None else (target,)
+			if any(target.id == bot_id for target in targets) is not self.targets_bot:
+				return False
+		return True
+
+
+class HandlerIndex:
+	"""
+	The handlers of one event type, indexed by the filters that narrow them down the most.
+	
+	Handlers filtered by character are kept under each of their character ids and handlers filtered
+	by room (and not character) under their room id, so for an event only the unfiltered handlers
+	and the ones indexed under its character and room are looked at, the rest are never touched.
+	Their remaining filters are then checked before they are called.
+	"""
+	
+	def __init__(self):
+		self.handlers = []
+		# handlers with neither a character nor a room filter, looked at for every event
+		self.unindexed = []
+		self.by_character = {}  # dict[character id: list[Handler]]
+		self.by_room = {}  # dict[room id: list[Handler]]
+	
+	def add(self, handler: Handler) -> None:
+		self.handlers.append(handler)
+		if handler.characters is not None:
+			for character in handler.characters:
+				self.by_character.setdefault(character, []).append(handler)
+		elif handler.room is not None:
+			self.by_room.setdefault(handler.room, []).append(handler)
+		else:
+			self.unindexed.append(handler)
+	
+	def remove(self, func) -> None:
+		self.handlers = [handler for handler in self.handlers if handler.func is not func]
+		self.unindexed = [handler for handler in self.unindexed if handler.func is not func]
+		for index in (self.by_character, self.by_room):
+			for key in list(index):
+				index[key] = [handler for handler in index[key] if handler.func is not func]
+				if not index[key]:
+					del index[key]
+	
+	def select(self, event: "EventBase", bot_id: str, room_of) -> list:
+		# the handlers to call for the event, room_of(event) is only called if a handler needs the room
+		candidates = self.unindexed
+		indexed = self.by_character.get(event.event.character.id)
+		room = None
+		if self.by_room or any(handler.room is not None for handler in indexed or ()):
+			room = room_of(event)
+			if room in self.by_room:
+				indexed = (indexed or []) + self.by_room[room]
+		if indexed:
+			candidates = sorted(candidates + indexed, key = lambda handler: handler.order)
+		return [handler for handler in candidates if handler.matches(event, bot_id, room)]
+	
+	def __contains__(self, func) -> bool:
+		return any(handler.func is func for handler in self.handlers)
+	
+	def __iter__(self):
+		return iter([handler.func for handler in self.handlers])
+	
+	def __len__(self) -> int:
+		return len(self.handlers)
@@ -1,10 +1,80 @@
+import atexit
+import logging
+import queue
+import sys
+import threading
+
+TRACE = 5
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+logging.addLevelName(TRACE, "TRACE")
+
+
+class LogWriter:
+	"""
+	Writes log lines to stdout from a background thread.
+	
+	Logging only puts the line on a queue, so a slow terminal never blocks the thread that logged
+	(such as the websocket thread). Lines that are queued together are written with one write call.
+	"""
+	
+	def __init__(self, stream = None):
+		self.stream = stream
+		self.queue = queue.SimpleQueue()
+		self.lock = threading.Lock()
+		self.thread = None
+		atexit.register(self.flush)
+	
+	def write(self, line: str) -> None:
+		if self.thread is None:
+			self.start()
+		self.queue.put(line)
+	
+	def start(self) -> None:
+		with self.lock:
+			if self.thread is None:
+				self.thread = threading.Thread(target = self.run, name = "Mucklet-log-writer", daemon = True)
+				self.thread.start()
+	
+	def run(self) -> None:
+		while True:
+			lines = [self.queue.get()]
+			self.drain(lines)
+	
+	def drain(self, lines: list[str]) -> None:
+		# gather everything that is already waiting so it goes out in one write
+		while True:
+			try:
+				lines.append(self.queue.get_nowait())
+			except queue.Empty:
+				break
+		stream = self.stream or sys.stdout
+		with self.lock:
+			stream.write("\n".join(lines) + "\n")
+			stream.flush()
+	
+	def flush(self) -> None:
+		# write out anything still queued, used at exit so the last messages are not lost
+		if not self.queue.empty():
+			self.drain([])
+
+
 class Logger:
 	iteration = 0
 	shown = True
+	# messages below this level are skipped without being formatted
+	threshold = INFO
+	writer = LogWriter()
+	# the standard library logger to send messages to, set by use_logging
+	logger = None
 	
-	def __init__(self, format_color: tuple[int, int, int] = (255, 50, 50), bold: bool = True):
+	def __init__(self, format_color: tuple[int, int, int] = (255, 50, 50), bold: bool = True, level: int = INFO):
 		self.format_color = format_color
 		self.bold = bold
+		self.level = level
 		# turn the format color into an ansi escape code
 		self.format_code = "\033[38;2;{};{};{}m".format(*format_color)
 		# add bold if needed
@@ -13,11 +83,19 @@ class Logger:
 		self.escape_code = "\033[0m"
 	
 	def __call__(self, _message: any, _raise: bool = False) -> None:
-		if not Logger.shown: return
+		if not self.enabled(): return
 		# print the message to the console
 		Logger.iteration += 1
-		if _raise: raise Exception(_message)
-		print(f"{self.format_code}{Logger.iteration}: {str(_message)}{self.escape_code}")
+		# messages may be given as a function so they are only built when they will be shown
+		message = _message() if callable(_message) else _message
+		if _raise: raise Exception(message)
+		if Logger.logger is not None:
+			Logger.logger.log(self.level, str(message))
+			return
+		Logger.writer.write(f"{self.format_code}{Logger.iteration}: {str(message)}{self.escape_code}")
+	
+	def enabled(self) -> bool:
+		return Logger.shown and self.level >= Logger.threshold
 	
 	@classmethod
 	def reset(cls) -> None:
@@ -36,8 +114,27 @@ class Logger:
 		cls.shown = not cls.shown
 	
 	@classmethod
-	def log_if_not_shown(cls, _message: str, color = (255, 255, 255)) -> None:
+	def set_level(cls, level: int) -> None:
+		cls.threshold = level
+	
+	@classmethod
+	def use_logging(cls, name: str = "Mucklet") -> logging.Logger:
+		# send messages to the standard library logging module instead of the console
+		cls.logger = logging.getLogger(name)
+		return cls.logger
+	
+	@classmethod
+	def use_console(cls) -> None:
+		cls.logger = None
+	
+	@classmethod
+	def log_if_not_shown(cls, _message: any, color = (255, 255, 255)) -> None:
+		if cls.shown:
+			return
+		message = _message() if callable(_message) else _message
+		if cls.logger is not None:
+			cls.logger.log(TRACE, str(message))
+			return
 		color_prefix = "\033[38;2;{};{};{}m".format(*color)
 		color_suffix = "\033[0m"
-		if not cls.shown:
-			print(f"{color_prefix}{_message}{color_suffix}")
+		cls.writer.write(f"{color_prefix}{message}{color_suffix}")
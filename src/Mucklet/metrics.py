@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+from .log import Logger
+
+
+class Histogram:
+	"""
+	Counts observations (in seconds) into fixed buckets.
+	
+	Observing is a bisect and an increment, so it is cheap enough for every request and every
+	handler call. Percentiles are estimated from the buckets, which is what Prometheus does too.
+	"""
+	
+	# 100us to 60s, roughly three buckets per power of ten
+	bounds = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+	          0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+	
+	def __init__(self):
+		self.counts = [0] * (len(Histogram.bounds) + 1)
+		self.count = 0
+		self.sum = 0
+		self.max = 0
+	
+	def observe(self, value: float) -> None:
+		self.counts[bisect.bisect_left(Histogram.bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+		if value > self.max:
+			self.max = value
+	
+	def percentile(self, percent: float) -> float:
+		if not self.count:
+			return 0
+		rank = self.count * percent / 100
+		seen = 0
+		for index, count in enumerate(self.counts):
+			if seen + count >= rank and count:
+				# interpolate within the bucket, the last bucket is capped by the largest value seen
+				lower = Histogram.bounds[index - 1] if index else 0
+				upper = Histogram.bounds[index] if index < len(Histogram.bounds) else self.max
+				return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+			seen += count
+		return self.max
+	
+	def stats(self) -> dict:
+		return {"count"  : self.count,
+		        "average": self.sum / self.count if self.count else 0,
+		        "p50"    : self.percentile(50),
+		        "p95"    : self.percentile(95),
+		        "p99"    : self.percentile(99),
+		        "max"    : self.max, }
+
+
+class Metrics:
+	"""
+	Collects client metrics: request round trip times and timeouts per method, inbound events per
+	type, handler execution time and timeouts per handler, and gauges such as the promise table size.
+	
+	Read them with snapshot(), or serve them in the Prometheus text format with serve().
+	"""
+	
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.requests = {}
+		self.timeouts = {}
+		self.events = {}
+		self.handlers = {}
+		self.handler_timeouts = {}
+		# name: function returning the current value, called each time the metrics are collected
+		self.gauges = {}
+		self.started = time.time()
+		self.server = None
+		self.log_info = Logger(format_color = (80, 80, 210), bold = False)
+	
+	@staticmethod
+	def method_label(method: str) -> str:
+		# drop the resource ids so every character shares a label, call.core.char.<id>.ctrl.say -> call.say
+		parts = method.split(".")
+		if parts[0] in ("call", "auth") and len(parts) > 1:
+			return f"{parts[0]}.{parts[-1]}"
+		return parts[0]
+	
+	def observe(self, table: dict, name: str, value: float) -> None:
+		with self.lock:
+			histogram = table.get(name)
+			if histogram is None:
+				histogram = table[name] = Histogram()
+			histogram.observe(value)
+	
+	def count(self, table: dict, name: str) -> None:
+		with self.lock:
+			table[name] = table.get(name, 0) + 1
+	
+	def request(self, method: str, rtt: float) -> None:
+		self.observe(self.requests, Metrics.method_label(method), rtt)
+	
+	def timeout(self, method: str) -> None:
+		self.count(self.timeouts, Metrics.method_label(method))
+	
+	def event(self, name: str) -> None:
+		self.count(self.events, name)
+	
+	def handler(self, name: str, duration: float) -> None:
+		self.observe(self.handlers, name, duration)
+	
+	def handler_timeout(self, name: str) -> None:
+		self.count(self.handler_timeouts, name)
+	
+	def timed(self, func, *args) -> any:
+		# call func, recording how long it took under its name
+		start = time.perf_counter()
+		try:
+			return func(*args)
+		finally:
+			self.handler(getattr(func, "__qualname__", str(func)), time.perf_counter() - start)
+	
+	def gauge(self, name: str, read) -> None:
+		self.gauges[name] = read
+	
+	def snapshot(self) -> dict:
+		uptime = time.time() - self.started
+		with self.lock:
+			return {"uptime"          : uptime,
+			        "requests"        : {name: histogram.stats() for name, histogram in self.requests.items()},
+			        "timeouts"        : dict(self.timeouts),
+			        "events"          : {name: {"count": count, "rate": count / uptime if uptime else 0}
+			                             for name, count in self.events.items()},
+			        "handlers"        : {name: histogram.stats() for name, histogram in self.handlers.items()},
+			        "handler_timeouts": dict(self.handler_timeouts),
+			        "gauges"          : {name: read() for name, read in self.gauges.items()}, }
+	
+	def prometheus(self, prefix: str = "mucklet") -> str:
+		lines = []
+		
+		def histogram(name: str, label: str, table: dict, help: str) -> None:
+			lines.append(f"# HELP {prefix}_{name} {help}")
+			lines.append(f"# TYPE {prefix}_{name} histogram")
+			for key, values in table.items():
+				cumulative = 0
+				for bound, count in zip(Histogram.bounds, values.counts):
+					cumulative += count
+					lines.append(f'{prefix}_{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+				lines.append(f'{prefix}_{name}_bucket{{{label}="{key}",le="+Inf"}} {values.count}')
+				lines.append(f'{prefix}_{name}_sum{{{label}="{key}"}} {values.sum}')
+				lines.append(f'{prefix}_{name}_count{{{label}="{key}"}} {values.count}')
+		
+		def counter(name: str, label: str, table: dict, help: str) -> None:
+			lines.append(f"# HELP {prefix}_{name} {help}")
+			lines.append(f"# TYPE {prefix}_{name} counter")
+			for key, count in table.items():
+				lines.append(f'{prefix}_{name}{{{label}="{key}"}} {count}')
+		
+		with self.lock:
+			histogram("request_seconds", "method", self.requests, "Request round trip time")
+			counter("request_timeouts_total", "method", self.timeouts, "Requests that timed out")
+			counter("events_total", "type", self.events, "Inbound events")
+			histogram("handler_seconds", "handler", self.handlers, "Handler execution time")
+			counter("handler_timeouts_total", "handler", self.handler_timeouts, "Handlers that ran past their timeout")
+		for name, read in self.gauges.items():
+			lines.append(f"# TYPE {prefix}_{name} gauge")
+			lines.append(f"{prefix}_{name} {read()}")
+		return "\n".join(lines) + "\n"
+	
+	def serve(self, port: int = 9464, host: str = "127.0.0.1") -> None:
+		# serve the metrics in the Prometheus text format on http://host:port/metrics from a background thread
+		from http.server import BaseHTTPRequestHandler
+		from http.server import ThreadingHTTPServer
+		metrics = self
+		
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = metrics.prometheus().encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			
+			def log_message(self, *args):
+				pass
+		
+		self.server = ThreadingHTTPServer((host, port), Handler)
+		threading.Thread(target = self.server.serve_forever, name = "Mucklet-metrics", daemon = True).start()
+		self.log_info(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics", False)
+	
+	def close(self) -> None:
+		if self.server is not None:
+			self.server.shutdown()
+			self.server = None
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket:
+	"""Allows rate events per second on average, with bursts of up to burst events."""
+	
+	def __init__(self, rate: float, burst: float):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+	
+	def refill(self, now: float) -> None:
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+	
+	def delay(self, now: float) -> float:
+		# how long until a token is available, 0 if one is available now
+		self.refill(now)
+		if self.tokens >= 1:
+			return 0
+		return (1 - self.tokens) / self.rate
+	
+	def take(self) -> None:
+		self.tokens -= 1
+
+
+class RateLimiter:
+	"""
+	Schedules outbound frames across priority lanes.
+	
+	Every frame is put in a lane by its method. Lanes are served in priority order:
+		control - handshake, subscriptions and control calls (ping, wakeup, controlChar ...), never limited
+		default - anything else, only limited by per method budgets
+		chat    - say, pose, message, whisper ... limited by the chat lane budget and per method budgets
+	
+	Frames within a lane keep their order, so a throttled chat message never lets a later one
+	overtake it, but control traffic is never stuck behind a chat backlog. Nothing is limited
+	unless a budget is set, with chat_rate or set_budget/set_lane_budget.
+	"""
+	
+	lanes = ("control", "default", "chat")
+	
+	chat_methods = {"say", "pose", "ooc", "describe", "message", "whisper", "address", "mail"}
+	control_methods = {"version", "auth", "subscribe", "unsubscribe", "get", "ping", "wakeup", "release",
+	                   "controlChar", "getBot"}
+	
+	def __init__(self, chat_rate: float | None = None, chat_burst: float = 10):
+		self.queues = {lane: deque() for lane in RateLimiter.lanes}
+		self.lane_buckets = {} if chat_rate is None else {"chat": TokenBucket(chat_rate, chat_burst)}
+		self.method_buckets = {}
+		self.method_lanes = {}
+		self.condition = threading.Condition()
+		self.on_put = None
+	
+	def set_budget(self, method: str, rate: float, burst: float = 1) -> None:
+		# limit a method (the last part of the request method, e.g. "say") to rate calls per second
+		with self.condition:
+			self.method_buckets[method] = TokenBucket(rate, burst)
+	
+	def set_lane_budget(self, lane: str, rate: float, burst: float = 1) -> None:
+		with self.condition:
+			self.lane_buckets[lane] = TokenBucket(rate, burst)
+	
+	def set_lane(self, method: str, lane: str) -> None:
+		if lane not in RateLimiter.lanes:
+			raise ValueError(f"Unknown lane '{lane}'. Lanes are: {', '.join(RateLimiter.lanes)}")
+		self.method_lanes[method] = lane
+	
+	@staticmethod
+	def method_name(method: str | None) -> str:
+		# call.core.char.<id>.ctrl.say -> say, subscribe.core.info -> subscribe
+		if not method:
+			return ""
+		kind = method.split(".", 1)[0]
+		if kind in ("call", "auth"):
+			return method.rsplit(".", 1)[-1]
+		return kind
+	
+	def classify(self, method: str | None) -> tuple[str, str]:
+		name = RateLimiter.method_name(method)
+		if name in self.method_lanes:
+			return self.method_lanes[name], name
+		if name in RateLimiter.chat_methods:
+			return "chat", name
+		if name in RateLimiter.control_methods or not name:
+			return "control", name
+		return "default", name
+	
+	def put(self, item: any, method: str | None = None) -> None:
+		lane, name = self.classify(method)
+		with self.condition:
+			self.queues[lane].append((item, name))
+			self.condition.notify()
+		if self.on_put is not None:
+			self.on_put()
+	
+	def poll(self) -> tuple[any, float | None]:
+		"""
+		Take the next frame that may be sent now.
+		
+		Returns (item, 0) if there is one, otherwise (None, delay) where delay is how long until a
+		queued frame may be sent, or None if nothing is queued.
+		"""
+		with self.condition:
+			now = time.monotonic()
+			wait = None
+			for lane in RateLimiter.lanes:
+				queue = self.queues[lane]
+				if not queue:
+					continue
+				item, name = queue[0]
+				buckets = [bucket for bucket in (self.lane_buckets.get(lane), self.method_buckets.get(name))
+				           if bucket is not None]
+				delay = max([bucket.delay(now) for bucket in buckets], default = 0)
+				if delay == 0:
+					for bucket in buckets:
+						bucket.take()
+					queue.popleft()
+					return item, 0
+				wait = delay if wait is None else min(wait, delay)
+			return None, wait
+	
+	def get(self, block: bool = True) -> any:
+		# the next frame that may be sent, waiting for one if block is set (otherwise None)
+		with self.condition:
+			while True:
+				item, wait = self.poll()
+				if item is not None or not block:
+					return item
+				self.condition.wait(wait)
+	
+	@property
+	def depth(self) -> int:
+		return sum(len(queue) for queue in self.queues.values())
+	
+	@property
+	def depths(self) -> dict[str, int]:
+		return {lane: len(queue) for lane, queue in self.queues.items()}
@@ -0,0 +1,122 @@
+import gzip
+import threading
+import time
+from .log import Logger
+
+INBOUND = "<"
+OUTBOUND = ">"
+
+
+class Recorder:
+	"""
+	Appends every raw frame a connection sends or receives to a file.
+	
+	Each frame is one line, "<time>\\t<direction>\\t<frame>", where direction is < for inbound and
+	> for outbound. Paths ending in .gz are gzip compressed. Frames are buffered and the file is
+	flushed when the recorder is closed (or by flush()).
+	"""
+	
+	def __init__(self, path: str):
+		self.path = path
+		self.file = gzip.open(path, "at", encoding = "utf-8") if path.endswith(".gz") \
+			else open(path, "a", encoding = "utf-8")
+		self.lock = threading.Lock()
+		self.frames = 0
+	
+	def record(self, direction: str, frame: str | bytes) -> None:
+		if type(frame) is bytes:
+			frame = frame.decode()
+		# a json frame can only contain a newline as whitespace between tokens, so it is safe to drop
+		line = f"{time.time():.6f}\t{direction}\t{frame.replace(chr(10), ' ')}\n"
+		with self.lock:
+			if self.file is None:
+				return
+			self.file.write(line)
+			self.frames += 1
+	
+	def inbound(self, frame: str | bytes) -> None:
+		self.record(INBOUND, frame)
+	
+	def outbound(self, frame: str | bytes) -> None:
+		self.record(OUTBOUND, frame)
+	
+	def flush(self) -> None:
+		with self.lock:
+			if self.file is not None:
+				self.file.flush()
+	
+	def close(self) -> None:
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+
+def read_recording(path: str, direction: str | None = INBOUND) -> list[tuple[float, str, str]]:
+	# the (time, direction, frame) entries of a recording, only the given direction unless it is None
+	opener = gzip.open if path.endswith(".gz") else open
+	entries = []
+	with opener(path, "rt", encoding = "utf-8") as file:
+		for line in file:
+			line = line.rstrip("\n")
+			if not line:
+				continue
+			timestamp, kind, frame = line.split("\t", 2)
+			if direction is None or kind == direction:
+				entries.append((float(timestamp), kind, frame))
+	return entries
+
+
+class Replay:
+	"""
+	Feeds the inbound frames of a recording back through a client's on_message.
+	
+	Frames are replayed at their original pace scaled by speed (2 is twice as fast), or as fast as
+	possible when speed is None. Nothing is sent, responses to requests in the recording are cached
+	like any other frame but are not matched with a request.
+		
+		result = Replay("traffic.rec.gz").run(client, speed = None)
+		print(result["frames_per_second"])
+	"""
+	
+	def __init__(self, path: str):
+		self.path = path
+		self.entries = read_recording(path)
+		self.log_info = Logger(format_color = (80, 80, 210), bold = False)
+	
+	def __len__(self) -> int:
+		return len(self.entries)
+	
+	def run(self, client, speed: float | None = 1, wait: bool = True, timeout: float = 60) -> dict:
+		"""
+		Replay every inbound frame into client.
+		
+		If wait is set, also waits (up to timeout) for the dispatched handlers to finish, so the
+		result covers the whole pipeline. Returns the number of frames and how long they took.
+		"""
+		client.replaying = True
+		try:
+			start = time.perf_counter()
+			first = self.entries[0][0] if self.entries else 0
+			for timestamp, _, frame in self.entries:
+				if speed:
+					delay = (timestamp - first) / speed - (time.perf_counter() - start)
+					if delay > 0:
+						time.sleep(delay)
+				client.on_message(None, frame)
+			fed = time.perf_counter() - start
+			if wait:
+				# an empty queue is not enough, the last handlers may still be running
+				client.dispatcher.wait_idle(timeout)
+			elapsed = time.perf_counter() - start
+		finally:
+			client.replaying = False
+		
+		result = {"frames"           : len(self.entries),
+		          "feed_time"        : fed,
+		          "elapsed"          : elapsed,
+		          "frames_per_second": len(self.entries) / elapsed if elapsed else 0,
+		          "speed"            : speed, }
+		self.log_info(lambda: f"Replayed {result['frames']} frames in {elapsed:.3f}s "
+		                      f"({result['frames_per_second']:.0f} frames/s)", False)
+		return result
@@ -0,0 +1,176 @@
+import queue
+import threading
+from collections import deque
+import time
+import traceback
+from .log import ERROR
+from .log import Logger
+
+
+class HandlerRunner:
+	"""
+	Runs event handlers so that they cannot hold each other up.
+	
+	Coroutine functions are run as tasks on an event loop (the client's if it has one, otherwise
+	one on a background thread) and are cancelled once they run past their timeout. Plain
+	functions are run on a bounded pool of threads, a thread cannot be stopped so one that runs
+	past its timeout is only reported. Each handler's exceptions are logged without affecting any
+	other handler, and how long it took is recorded in the client's metrics.
+	
+	Plain functions are never called on the calling thread, however fast they are, as any handler
+	may block (in wait_for, say). A handler that blocks only holds up its own pool thread, but
+	once all of them are blocked the handlers after them wait for one to return. The pool is fed
+	from a single queue rather than an executor, so a call costs one put and an idle thread wakes
+	to work through whatever has queued up since, which keeps up with handlers that take
+	microseconds.
+	
+	Plain functions run with the same key (Bot uses the character an event is from) are run one
+	at a time, in the order they were run in, while ones with other keys carry on around them. A
+	key's next function is only queued once the one before it returns, so a slow handler holds
+	up the later events of its own key and nothing else.
+	"""
+	
+	# seconds a handler may run for, unless it was given a timeout of its own
+	timeout = 30
+	
+	def __init__(self, metrics, workers: int = 8, loop: "asyncio.AbstractEventLoop | None" = None):
+		self.metrics = metrics
+		self.workers = workers
+		self.loop = loop
+		# whether the loop was started here, and so is stopped by close
+		self.owns_loop = False
+		# the pool's queue of (func, args, timeout), None until a plain function is first run
+		self.queue = None
+		self.lock = threading.Lock()
+		# thread id: (func, started, timeout) of every plain function running
+		self.active = {}
+		# key: deque of the (func, args, timeout, key) waiting for the one running with that key to return
+		self.keyed = {}
+		# func: whether it is a coroutine function, looked up once per call
+		self.coroutines = {}
+		self.watchdog = None
+		self.log_error = Logger(format_color = (210, 80, 80), bold = False, level = ERROR)
+	
+	@staticmethod
+	def name(func) -> str:
+		return getattr(func, "__qualname__", str(func))
+	
+	def get_loop(self) -> "asyncio.AbstractEventLoop":
+		import asyncio
+		with self.lock:
+			if self.loop is None or self.loop.is_closed():
+				self.loop = asyncio.new_event_loop()
+				self.owns_loop = True
+				threading.Thread(target = self.loop.run_forever, name = "Mucklet-handlers", daemon = True).start()
+			return self.loop
+	
+	def get_queue(self) -> queue.SimpleQueue:
+		# the pool's threads are started when a plain function is first run, not when the package is imported
+		with self.lock:
+			if self.queue is None:
+				self.queue = queue.SimpleQueue()
+				for number in range(self.workers):
+					threading.Thread(target = self.work, args = (self.queue,), name = f"Mucklet-handler_{number}",
+					                 daemon = True).start()
+				self.watchdog = threading.Thread(target = self.watch, args = (self.queue,),
+				                                 name = "Mucklet-handler-timeouts", daemon = True)
+				self.watchdog.start()
+			return self.queue
+	
+	def run(self, func, *args, timeout: float | None = None, key: any = None) -> None:
+		# start func(*args) without waiting for it, after any plain function run earlier with the same key
+		timeout = timeout or HandlerRunner.timeout
+		coroutine = self.coroutines.get(func)
+		if coroutine is None:
+			import inspect
+			coroutine = self.coroutines[func] = inspect.iscoroutinefunction(func)
+		if coroutine:
+			import asyncio
+			asyncio.run_coroutine_threadsafe(self.run_async(func, args, timeout), self.get_loop())
+		elif key is None:
+			self.get_queue().put((func, args, timeout, None))
+		else:
+			work = self.get_queue()
+			with self.lock:
+				waiting = self.keyed.get(key)
+				if waiting is not None:
+					waiting.append((func, args, timeout, key))
+					return
+				self.keyed[key] = deque()
+			work.put((func, args, timeout, key))
+	
+	def work(self, work: queue.SimpleQueue) -> None:
+		# run handlers from the queue until close replaces it, what is still queued then is dropped
+		while True:
+			item = work.get()
+			if item is None or self.queue is not work:
+				return
+			self.run_sync(*item)
+	
+	def done(self, key: any) -> None:
+		# queue the next function waiting on key, it goes to the back so other keys get their turn
+		with self.lock:
+			waiting = self.keyed.get(key)
+			if waiting is None:
+				return
+			if not waiting:
+				del self.keyed[key]
+				return
+			item = waiting.popleft()
+		work = self.queue
+		if work is not None:
+			work.put(item)
+	
+	def run_sync(self, func, args: tuple, timeout: float, key: any = None) -> any:
+		thread = threading.get_ident()
+		start = time.perf_counter()
+		self.active[thread] = (func, start, timeout)
+		try:
+			return func(*args)
+		except Exception:
+			self.log_error(f"Error in handler {HandlerRunner.name(func)}:\n{traceback.format_exc()}", False)
+		finally:
+			self.active.pop(thread, None)
+			self.metrics.handler(HandlerRunner.name(func), time.perf_counter() - start)
+			if key is not None:
+				self.done(key)
+	
+	async def run_async(self, func, args: tuple, timeout: float) -> any:
+		import asyncio
+		start = time.perf_counter()
+		try:
+			return await asyncio.wait_for(func(*args), timeout)
+		except asyncio.TimeoutError:
+			self.metrics.handler_timeout(HandlerRunner.name(func))
+			self.log_error(f"Handler {HandlerRunner.name(func)} was cancelled after {timeout}s", False)
+		except Exception:
+			self.log_error(f"Error in handler {HandlerRunner.name(func)}:\n{traceback.format_exc()}", False)
+		finally:
+			self.metrics.handler(HandlerRunner.name(func), time.perf_counter() - start)
+	
+	def watch(self, work: queue.SimpleQueue) -> None:
+		# report each plain function once it runs past its timeout, only running ones are looked at so
+		# this costs the same however many handlers are queued
+		reported = set()
+		while self.queue is work:
+			time.sleep(0.5)
+			now = time.perf_counter()
+			active = list(self.active.values())
+			for func, start, timeout in active:
+				if now - start > timeout and (func, start) not in reported:
+					reported.add((func, start))
+					self.metrics.handler_timeout(HandlerRunner.name(func))
+					self.log_error(f"Handler {HandlerRunner.name(func)} is still running after {timeout}s", False)
+			reported = {key for key in reported if any(key == (func, start) for func, start, _ in active)}
+	
+	def close(self) -> None:
+		with self.lock:
+			if self.queue is not None:
+				work, self.queue = self.queue, None
+				for _ in range(self.workers):
+					work.put(None)
+			self.keyed.clear()
+			if self.owns_loop and self.loop is not None:
+				self.loop.call_soon_threadsafe(self.loop.stop)
+				self.loop = None
+				self.owns_loop = False
@@ -0,0 +1,77 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from .log import ERROR
+from .log import Logger
+
+
+class Reaper:
+	"""
+	Runs callbacks once their deadline has passed.
+	
+	Deadlines are kept in a heap and a single background thread sleeps until the earliest one
+	is due, so any number of pending deadlines costs one thread. Callbacks should be quick, they
+	are run on the reaper thread one after another.
+	
+	A deadline that is no longer needed can be cancelled with the entry schedule returned. It is
+	only marked, and the heap is rebuilt without the marked entries once they make up most of it,
+	so deadlines that are cancelled long before they are due do not pile up.
+	"""
+	
+	# the heap is only compacted once it has at least this many cancelled entries
+	compact_after = 64
+	
+	def __init__(self, name: str = "Mucklet-reaper"):
+		self.name = name
+		self.heap = []
+		self.counter = itertools.count()
+		self.cancelled = 0
+		self.condition = threading.Condition()
+		self.thread = None
+		self.log_error = Logger(format_color = (210, 80, 80), bold = False, level = ERROR)
+	
+	def schedule(self, deadline: float, callback, *args) -> list:
+		# returns the entry, to cancel it with
+		entry = [deadline, next(self.counter), callback, args]
+		with self.condition:
+			heapq.heappush(self.heap, entry)
+			if self.thread is None:
+				self.thread = threading.Thread(target = self.run, name = self.name, daemon = True)
+				self.thread.start()
+			# wake the thread in case this deadline is earlier than the one it is sleeping on
+			self.condition.notify()
+		return entry
+	
+	def cancel(self, entry: list) -> None:
+		with self.condition:
+			if entry[2] is None:
+				return
+			entry[2] = entry[3] = None
+			self.cancelled += 1
+			if self.cancelled >= Reaper.compact_after and self.cancelled * 2 > len(self.heap):
+				self.heap = [item for item in self.heap if item[2] is not None]
+				heapq.heapify(self.heap)
+				self.cancelled = 0
+	
+	def run(self) -> None:
+		while True:
+			with self.condition:
+				while not self.heap or self.heap[0][0] > time.time():
+					self.condition.wait(self.heap[0][0] - time.time() if self.heap else None)
+				entry = heapq.heappop(self.heap)
+				_, _, callback, args = entry
+				if callback is None:
+					self.cancelled -= 1
+					continue
+				# it is out of the heap, so cancelling it from now on does nothing
+				entry[2] = entry[3] = None
+			try:
+				callback(*args)
+			except Exception:
+				self.log_error(f"Error in {getattr(callback, '__name__', callback)}:\n{traceback.format_exc()}", False)
+	
+	def __len__(self) -> int:
+		# the deadlines still pending, not counting cancelled ones
+		return len(self.heap) - self.cancelled
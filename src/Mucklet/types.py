@@ -1,17 +1,274 @@
-from .ResClient import Request
-from .CachedDictionary import CachedDictionary
+import threading
+import weakref
+from collections import deque
+from typing import NamedTuple
+from typing import TYPE_CHECKING
+from .CachedDictionary import LazyCachedDictionary
 
-try:
+if TYPE_CHECKING:
+	# only for annotations, so using the types does not import the bot or the websocket client
 	from .bot import Bot
-except ImportError:
-	pass
+	from .ResClient import Request
+
+
+class EntityMap:
+	"""
+	Maps (type, id) to the entity with that id, holding only weak references.
+	
+	The most recently created entities are also held strongly, so the characters involved in a stream
+	of events are reused rather than being collected and created again for every event.
+	References to collected entities are not removed straight away (a removal callback would cost more
+	than the lookup), instead they are swept out whenever the map has doubled in size.
+	"""
+	
+	def __init__(self, recent: int = 256):
+		self.references = {}
+		self.recent = deque(maxlen = recent)
+		self.limit = 1024
+		self.lock = threading.Lock()
+	
+	def get(self, cls: type, bot: "Bot", id: str) -> "Entity":
+		key = (cls, id)
+		reference = self.references.get(key)
+		if reference is not None:
+			entity = reference()
+			if entity is not None:
+				return entity
+		return self.create(key, cls, bot, id)
+	
+	def create(self, key: tuple, cls: type, bot: "Bot", id: str) -> "Entity":
+		with self.lock:
+			# another thread may have created it in the meantime
+			reference = self.references.get(key)
+			entity = reference() if reference is not None else None
+			if entity is None:
+				entity = Entity.create(cls, bot, id)
+				self.references[key] = weakref.ref(entity)
+				self.recent.append(entity)
+				if len(self.references) > self.limit:
+					self.sweep()
+		return entity
+	
+	def sweep(self) -> None:
+		self.references = {key: reference for key, reference in self.references.items() if reference() is not None}
+		self.limit = max(1024, 2 * len(self.references))
+	
+	def __len__(self) -> int:
+		return sum(1 for reference in list(self.references.values()) if reference() is not None)
+
+
+class Entity:
+	"""
+	Base for the game objects (characters, rooms, areas and exits), which only hold their id and read
+	everything else from the cache.
+	
+	Entities are flyweights: creating one with the id of an entity of the same type that is still in use
+	returns that same object, so each entity is one shared instance per bot and can be compared with is.
+	The bot only keeps weak references to them, so entities nothing uses any more are collected.
+	"""
+	__slots__ = ("bot", "id", "__weakref__")
+	
+	def __new__(cls, bot: "Bot", id: str):
+		entities = getattr(bot, "entities", None)
+		if entities is None:
+			return Entity.create(cls, bot, id)
+		# the common case, inlined from EntityMap.get
+		reference = entities.references.get((cls, id))
+		if reference is not None:
+			entity = reference()
+			if entity is not None:
+				return entity
+		return entities.create((cls, id), cls, bot, id)
+	
+	@staticmethod
+	def create(cls, bot: "Bot", id: str) -> "Entity":
+		entity = object.__new__(cls)
+		entity.bot = bot
+		entity.id = id
+		return entity
+	
+	def __reduce__(self):
+		return self.__class__, (self.bot, self.id)
+	
+	# set by each entity type: the record snapshot() returns, the resources its fields are read from (the
+	# first that has a field wins), model keys that differ from the field name, and fields that refer to
+	# other entities
+	Snapshot = None
+	snapshot_rids = ()
+	snapshot_keys = {}
+	snapshot_references = {}
+	# model keys whose {"rid": ...} reference is followed to the resource's contents, as their property does
+	snapshot_follow = ()
+	# the model key of every snapshot field after id, in order, filled in by prepare_snapshot
+	snapshot_fields = ()
+	snapshot_followed = frozenset()
+	
+	def snapshot(self):
+		"""
+		Every field of the entity at once, as an immutable record.
+		
+		The model is looked up once, rather than once per property, so this is much cheaper than reading
+		several properties. The record does not change when the cache does, take a new snapshot for that.
+		"""
+		return self.snapshots(self.bot, (self.id,))[0]
+	
+	@classmethod
+	def prepare_snapshot(cls, references: dict) -> None:
+		cls.snapshot_references = {cls.Snapshot._fields.index(field): reference for field, reference in references.items()}
+		cls.snapshot_fields = tuple(cls.snapshot_keys.get(field, field) for field in cls.Snapshot._fields[1:])
+		cls.snapshot_followed = frozenset(index + 1 for index, key in enumerate(cls.snapshot_fields)
+		                                  if key in cls.snapshot_follow)
+	
+	@classmethod
+	def snapshots(cls, bot: "Bot", ids) -> list:
+		# snapshots of many entities, every model that is not cached yet is subscribed to at once
+		cache = bot.client.cache
+		missing = list(ids)
+		for rid in cls.snapshot_rids:
+			# only fall back to the next resource for the entities the previous ones could not be found for
+			for request in cache.prefetch(*[rid.format(id) for id in missing]):
+				request.wait()
+			missing = [id for id in missing if rid.format(id) not in cache.data]
+		if cls.snapshot_follow:
+			# and the resources the followed fields reference, all at once as well
+			followed = []
+			for id in ids:
+				for rid in cls.snapshot_rids:
+					model = cache.data.get(rid.format(id))
+					if type(model) is dict:
+						followed += [model[key]["rid"] for key in cls.snapshot_follow
+						             if type(model.get(key)) is dict and "rid" in model[key]]
+			for request in cache.prefetch(*followed):
+				request.wait()
+		return [cls.record(bot, cache.data, id) for id in ids]
+	
+	@classmethod
+	def record(cls, bot: "Bot", data: dict, id: str):
+		model = None
+		for rid in cls.snapshot_rids:
+			found = data.get(rid.format(id))
+			if type(found) is dict:
+				# earlier resources take precedence, later ones only fill in what they are missing
+				model = found if model is None else {**found, **{key: value for key, value in model.items()
+				                                                  if value is not None}}
+		if model is None:
+			model = {}
+		values = [model.get(key) for key in cls.snapshot_fields]
+		values.insert(0, id)
+		for index, value in enumerate(values):
+			if index in cls.snapshot_followed:
+				if type(value) is dict and "rid" in value:
+					value = data.get(value["rid"])
+				# the contents of the referenced resource, the keys of a model or the items of a collection
+				values[index] = None if value is None else tuple(value)
+			elif index in cls.snapshot_references:
+				values[index] = Entity.reference(bot, data, value, cls.snapshot_references[index])
+			elif type(value) is dict and "data" in value:
+				# a data value, such as exit keys
+				values[index] = tuple(value["data"]) if type(value["data"]) is list else value["data"]
+			elif type(value) is list:
+				values[index] = tuple(value)
+		return cls.Snapshot._make(values)
+	
+	@staticmethod
+	def reference(bot: "Bot", data: dict, value: any, cls: type) -> any:
+		# the entity a {"rid": ...} reference points to, or a tuple of them for a collection
+		if type(value) is list:
+			return tuple(Entity.reference(bot, data, item, cls) for item in value)
+		if type(value) is not dict or "rid" not in value:
+			return None
+		rid = value["rid"]
+		target = data.get(rid)
+		if type(target) is list:
+			return Entity.reference(bot, data, target, cls)
+		id = target.get("id") if type(target) is dict else None
+		if not id:
+			# rids are <service>.<type>.<id>[.<part>], so the id can be read from the rid if it is not cached
+			parts = rid.split(".") if type(rid) is str else ()
+			if len(parts) < 3 or not parts[2]:
+				raise ValueError(f"Cannot read a {cls.__name__} id from the resource id {rid!r}, "
+				                 f"expected <service>.<type>.<id>")
+			id = parts[2]
+		return cls(bot, id)
+
+
+class CharacterSnapshot(NamedTuple):
+	id: str
+	name: str | None = None
+	surname: str | None = None
+	avatar: str | None = None
+	awake: bool | None = None
+	gender: str | None = None
+	idle: int | None = None
+	last_awake: int | None = None
+	species: str | None = None
+	state: str | None = None
+	status: str | None = None
+	tags: tuple | None = None
+	type: str | None = None
+	
+	@property
+	def full_name(self) -> str:
+		return f"{self.name} {self.surname}"
+
+
+class AreaSnapshot(NamedTuple):
+	id: str
+	name: str | None = None
+	short_description: str | None = None
+	about: str | None = None
+	children: tuple["Room", ...] | None = None
+	image: dict | None = None
+	map_x: int | None = None
+	map_y: int | None = None
+	owner: "Character | None" = None
+	parent: "Area | None" = None
+	pop: int | None = None
+	private: bool | None = None
+	prv: int | None = None
+	rules: str | None = None
+
+
+class RoomSnapshot(NamedTuple):
+	id: str
+	name: str | None = None
+	description: str | None = None
+	area: "Area | None" = None
+	owner: "Character | None" = None
+	characters: tuple["Character", ...] | None = None
+	exits: tuple["Exit", ...] | None = None
+	autosweep: bool | None = None
+	autosweep_delay: int | None = None
+	image: dict | None = None
+	is_dark: bool | None = None
+	is_home: bool | None = None
+	is_quiet: bool | None = None
+	is_teleport: bool | None = None
+	map_x: int | None = None
+	map_y: int | None = None
+	pop: int | None = None
+	private: bool | None = None
+
+
+class ExitSnapshot(NamedTuple):
+	id: str
+	name: str | None = None
+	keys: tuple | None = None
+	arrive_message: str | None = None
+	leave_message: str | None = None
+	travel_message: str | None = None
+	created: int | None = None
+	hidden: bool | None = None
+	target_room: "Room | None" = None
 
 
 # Properties used by all events
-class Character:
-	def __init__(self, bot: "Bot", id: str) -> None:
-		self.bot: "Bot" = bot
-		self.id = id
+class Character(Entity):
+	__slots__ = ()
+	Snapshot = CharacterSnapshot
+	snapshot_rids = ("core.char.{}",)
+	snapshot_keys = {"last_awake": "lastAwake"}
+	snapshot_follow = ("tags",)
 	
 	def __str__(self):
 		return f"{self.full_name} ({self.id})"
@@ -19,13 +276,13 @@ class Character:
 	def __repr__(self):
 		return str(self)
 	
-	def message(self, message: str, pose: bool = False, ooc: bool = False) -> Request:
+	def message(self, message: str, pose: bool = False, ooc: bool = False) -> "Request":
 		return self.bot.message(self, message, pose, ooc)
 	
-	def whisper(self, message: str, pose: bool = False, ooc: bool = False) -> Request:
+	def whisper(self, message: str, pose: bool = False, ooc: bool = False) -> "Request":
 		return self.bot.whisper(self, message, pose, ooc)
 	
-	def address(self, message: str, pose: bool = False, ooc: bool = False) -> Request:
+	def address(self, message: str, pose: bool = False, ooc: bool = False) -> "Request":
 		return self.bot.address(self, message, pose, ooc)
 	
 	def summon(self):
@@ -71,7 +328,9 @@ class Character:
 		return str(self.bot.client.cache.get(f"core.char.{self.id}", "type"))
 	
 	def get_full_name(self):
-		return str(self.name + " " + self.surname)
+		# only two fields, read from the cached model rather than through a snapshot of all of them
+		model = self.bot.client.cache.get(f"core.char.{self.id}", default = {})
+		return f"{model.get('name')} {model.get('surname')}"
 	
 	def get_local_storage(self):
 		# check if the storage exists
@@ -81,7 +340,13 @@ class Character:
 		# return the storage
 		return Character.LocalCharacterStorage.get(self.id)
 	
-	LocalCharacterStorage = CachedDictionary("Local Character Storage")
+	# every character's local storage, created (and read from disk) the first time it is used
+	LocalCharacterStorage = LazyCachedDictionary("Local Character Storage")
+	
+	@classmethod
+	def set_storage_path(cls, path: str) -> None:
+		# where the local storage is kept, relative to the working directory unless it is absolute
+		cls.__dict__["LocalCharacterStorage"].set_path(path)
 	
 	name = property(get_name)
 	surname = property(get_surname)
@@ -100,10 +365,11 @@ class Character:
 	full_name = property(get_full_name)
 
 
-class Area:
-	def __init__(self, bot: "Bot", id: str):
-		self.bot = bot
-		self.id = id
+class Area(Entity):
+	__slots__ = ()
+	Snapshot = AreaSnapshot
+	snapshot_rids = ("core.area.{}.details",)
+	snapshot_keys = {"short_description": "shortDesc", "map_x": "mapX", "map_y": "mapY"}
 	
 	def __str__(self):
 		return f"{self.name} {self.short_description} ({self.id})"
@@ -165,10 +431,19 @@ class Area:
 	short_description = property(get_short_description)
 
 
-class Room:
-	def __init__(self, bot: "Bot", id: str) -> None:
-		self.bot = bot
-		self.id = id
+class Room(Entity):
+	__slots__ = ()
+	Snapshot = RoomSnapshot
+	snapshot_rids = ("core.room.{}.details", "core.room.{}")
+	snapshot_keys = {"description"    : "desc",
+	                 "characters"     : "chars",
+	                 "autosweep_delay": "autosweepDelay",
+	                 "is_dark"        : "isDark",
+	                 "is_home"        : "isHome",
+	                 "is_quiet"       : "isQuiet",
+	                 "is_teleport"    : "isTeleport",
+	                 "map_x"          : "mapX",
+	                 "map_y"          : "mapY", }
 	
 	def __str__(self):
 		return f"{self.name} ({self.id})"
@@ -249,10 +524,14 @@ class Room:
 	private = property(get_private)
 
 
-class Exit:
-	def __init__(self, bot: "Bot", id: str):
-		self.bot = bot
-		self.id = id
+class Exit(Entity):
+	__slots__ = ()
+	Snapshot = ExitSnapshot
+	snapshot_rids = ("core.exit.{}.details", "core.exit.{}")
+	snapshot_keys = {"arrive_message": "arriveMsg",
+	                 "leave_message" : "leaveMsg",
+	                 "travel_message": "travelMsg",
+	                 "target_room"   : "targetRoom", }
 	
 	def __str__(self):
 		return f"{self.name} {self.keys} ({self.id})"
@@ -296,7 +575,22 @@ class Exit:
 	travel_message = property(get_travel_message)
 
 
+# the entity types refer to each other, so their references are filled in once they all exist
+Character.prepare_snapshot({})
+Area.prepare_snapshot({"children": Room, "owner": Character, "parent": Area})
+Room.prepare_snapshot({"area": Area, "owner": Character, "characters": Character, "exits": Exit})
+Exit.prepare_snapshot({"target_room": Room})
+
+
+def reference_id(data: dict, key: str) -> str | None:
+	# the id of a reference such as data["char"], None if it is missing
+	value = data.get(key)
+	return value.get("id") if value else None
+
+
 class EventBase:
+	__slots__ = ("id", "type", "time", "sig", "event")
+	
 	def __init__(self, id: int, type: str, time: float, sig: str):
 		self.id = id
 		self.type = type
@@ -310,29 +604,45 @@ class EventBase:
 
 # say, pose, wakeup, sleep, leave, arrive, describe, action
 class CharacterMessageEvent:
+	__slots__ = ("character", "message", "puppeteer")
+	
 	def __init__(self, character: Character, message: str, puppeteer: Character | None = None):
 		self.character = character
 		self.message = message
 		self.puppeteer = puppeteer
 	
+	@classmethod
+	def decode(cls, bot: "Bot", data: dict) -> "CharacterMessageEvent":
+		return cls(Character(bot, reference_id(data, "char")), data.get("msg"),
+		           Character(bot, reference_id(data, "puppeteer")))
+	
 	def __str__(self):
-		return f"{self.character.name} {self.character.surname} says \"{self.message}\""
+		return f"{self.character.full_name} says \"{self.message}\""
 
 
 # ooc
 class CharacterPoseableMessageEvent:
+	__slots__ = ("character", "message", "pose", "puppeteer")
+	
 	def __init__(self, character: Character, message: str, pose: bool = False, puppeteer: Character | None = None):
 		self.character = character
 		self.message = message
 		self.pose = pose
 		self.puppeteer = puppeteer
 	
+	@classmethod
+	def decode(cls, bot: "Bot", data: dict) -> "CharacterPoseableMessageEvent":
+		return cls(Character(bot, reference_id(data, "char")), data.get("msg"), data.get("pose"),
+		           Character(bot, reference_id(data, "puppeteer")))
+	
 	def __str__(self):
-		return f"{self.character.name} {self.character.surname} says \"{self.message}\""
+		return f"{self.character.full_name} says \"{self.message}\""
 
 
 # whisper, message, warn, mail, address, controlRequest
 class TargetedCharacterMessageEvent:
+	__slots__ = ("character", "message", "target", "ooc", "pose", "puppeteer", "targets")
+	
 	def __init__(self, character: Character,
 	             message: str,
 	             target: Character,
@@ -351,29 +661,51 @@ class TargetedCharacterMessageEvent:
 			self.targets = []
 		self.targets.append(self.target)
 	
+	@classmethod
+	def decode(cls, bot: "Bot", data: dict) -> "TargetedCharacterMessageEvent":
+		targets = data.get("targets")
+		return cls(Character(bot, reference_id(data, "char")), data.get("msg"),
+		           Character(bot, reference_id(data, "target")), data.get("ooc"), data.get("pose"),
+		           Character(bot, reference_id(data, "puppeteer")),
+		           [Character(bot, target.get("id")) for target in targets] if targets else [])
+	
 	def __str__(self):
-		return f"{self.character.name} {self.character.surname} says \"{self.message}\" to " \
-		       f"{self.target.name} {self.target.surname}"
+		return f"{self.character.full_name} says \"{self.message}\" to {self.target.full_name}"
 
 
 # travel
 class TargetRoomMessageEvent:
+	__slots__ = ("character", "message", "target", "puppeteer")
+	
 	def __init__(self, character: Character, message: str, target_room: Room, puppeteer: Character | None = None):
 		self.character = character
 		self.message = message
 		self.target = target_room
 		self.puppeteer = puppeteer
 	
+	@classmethod
+	def decode(cls, bot: "Bot", data: dict) -> "TargetRoomMessageEvent":
+		return cls(Character(bot, reference_id(data, "char")), data.get("msg"),
+		           Room(bot, reference_id(data, "targetRoom")),
+		           Character(bot, reference_id(data, "puppeteer")))
+	
 	def __str__(self):
-		return f"{self.character.name} {self.character.surname} says \"{self.message}\" to {self.target.name}"
+		return f"{self.character.full_name} says \"{self.message}\" to {self.target.name}"
 
 
 # summon, join, leadRequest, followRequest, follow, stopFollow, stopLead
 class TargetedCharacterEvent:
+	__slots__ = ("character", "target", "puppeteer")
+	
 	def __init__(self, character: Character, target: Character, puppeteer: Character | None = None):
 		self.character = character
 		self.target = target
 		self.puppeteer = puppeteer
 	
+	@classmethod
+	def decode(cls, bot: "Bot", data: dict) -> "TargetedCharacterEvent":
+		return cls(Character(bot, reference_id(data, "char")), Character(bot, reference_id(data, "target")),
+		           Character(bot, reference_id(data, "puppeteer")))
+	
 	def __str__(self):
-		return f"{self.character.name} {self.character.surname} is targeting {self.target.name} {self.target.surname}"
+		return f"{self.character.full_name} is targeting {self.target.full_name}"
@@ -0,0 +1,125 @@
+import threading
+
+
+class Waiter:
+	"""
+	A pending wait for the first event that matches a predicate.
+	
+	Waiting blocks on a threading.Event (or awaits an asyncio future), so a waiter costs nothing
+	while nothing arrives. The matching event is kept as result.
+	"""
+	
+	__slots__ = ("key", "predicate", "result", "done", "future", "loop")
+	
+	def __init__(self, key: any, predicate = None):
+		self.key = key
+		self.predicate = predicate
+		self.result = None
+		self.done = threading.Event()
+		self.future = None
+		self.loop = None
+	
+	def matches(self, event: any) -> bool:
+		return self.predicate is None or self.predicate(event)
+	
+	def resolve(self, event: any) -> None:
+		# result is set by Waiters.offer while it holds the lock, so a waiter that is removed always sees it
+		self.result = event
+		self.done.set()
+		if self.future is not None:
+			self.loop.call_soon_threadsafe(self.resolve_future)
+	
+	def resolve_future(self) -> None:
+		if self.future is not None and not self.future.done():
+			self.future.set_result(self.result)
+	
+	def wait(self, timeout: float | None = None) -> any:
+		# the matching event, or None if none arrived within timeout seconds
+		self.done.wait(timeout)
+		return self.result
+	
+	async def wait_async(self, timeout: float | None = None) -> any:
+		# imported here so that waiting from threads never pays for importing asyncio
+		import asyncio
+		if self.done.is_set():
+			return self.result
+		self.loop = asyncio.get_running_loop()
+		self.future = self.loop.create_future()
+		# the event may have arrived between the check above and the future existing
+		if self.done.is_set():
+			return self.result
+		try:
+			return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+		except asyncio.TimeoutError:
+			return self.result
+
+
+class Waiters:
+	"""
+	Every pending wait, keyed by what they are waiting on (such as a character id).
+	
+	An event is offered to the waiters under its key, and then to the ones waiting on any key
+	(None), oldest first. The first waiter whose predicate matches takes the event and is removed,
+	so any number of waits can be pending at once, even several on the same key.
+	"""
+	
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.waiters = {}  # dict[key: list[Waiter]]
+	
+	def add(self, key: any = None, predicate = None) -> Waiter:
+		waiter = Waiter(key, predicate)
+		with self.lock:
+			self.waiters.setdefault(key, []).append(waiter)
+		return waiter
+	
+	def remove(self, waiter: Waiter) -> None:
+		with self.lock:
+			waiting = self.waiters.get(waiter.key)
+			if waiting is not None and waiter in waiting:
+				waiting.remove(waiter)
+				if not waiting:
+					del self.waiters[waiter.key]
+	
+	def offer(self, key: any, event: any) -> bool:
+		# give the event to the first matching waiter, returns whether one took it
+		if not self.waiters:
+			return False
+		with self.lock:
+			candidates = self.waiters.get(key, []) + (self.waiters.get(None, []) if key is not None else [])
+		for waiter in candidates:
+			if not waiter.matches(event):
+				continue
+			with self.lock:
+				waiting = self.waiters.get(waiter.key)
+				# another thread may have handed this waiter an event in the meantime
+				if waiting is None or waiter not in waiting:
+					continue
+				waiting.remove(waiter)
+				if not waiting:
+					del self.waiters[waiter.key]
+				waiter.result = event
+			waiter.resolve(event)
+			return True
+		return False
+	
+	def wait(self, key: any = None, predicate = None, timeout: float | None = None) -> any:
+		# the matching event, or None if none arrived within timeout seconds
+		waiter = self.add(key, predicate)
+		try:
+			waiter.wait(timeout)
+		finally:
+			self.remove(waiter)
+		return waiter.result
+	
+	async def wait_async(self, key: any = None, predicate = None, timeout: float | None = None) -> any:
+		waiter = self.add(key, predicate)
+		try:
+			await waiter.wait_async(timeout)
+		finally:
+			self.remove(waiter)
+		return waiter.result
+	
+	def __len__(self) -> int:
+		with self.lock:
+			return sum(len(waiting) for waiting in self.waiters.values())
@@ -0,0 +1,89 @@
+import threading
+import time
+import traceback
+from .log import ERROR
+from .log import Logger
+from .ratelimit import RateLimiter
+
+
+class QueueLatency:
+	"""Keeps track of how long frames wait in an outbound queue before they are written."""
+	
+	def __init__(self):
+		self.frames = 0
+		self.writes = 0
+		self.total = 0
+		self.max = 0
+		self.last = 0
+	
+	def observe(self, enqueued: list[float]) -> None:
+		# one write of len(enqueued) frames has just finished
+		now = time.perf_counter()
+		self.writes += 1
+		for start in enqueued:
+			self.last = now - start
+			self.total += self.last
+			self.max = max(self.max, self.last)
+		self.frames += len(enqueued)
+	
+	def stats(self) -> dict:
+		return {"frames"           : self.frames,
+		        "writes"           : self.writes,
+		        "frames_per_write" : self.frames / self.writes if self.writes else 0,
+		        "average_latency"  : self.total / self.frames if self.frames else 0,
+		        "max_latency"      : self.max,
+		        "last_latency"     : self.last, }
+
+
+class Writer:
+	"""
+	Writes outbound frames from a single thread.
+	
+	put() only queues the frame, so senders never block on the socket and never write to it
+	concurrently. Frames are released by the rate limiter, and frames that are released back to
+	back are handed to write together (up to batch_size at a time) so they can go out in one syscall.
+	"""
+	
+	def __init__(self, write, limiter: RateLimiter | None = None, batch_size: int = 64):
+		self.write = write
+		self.batch_size = batch_size
+		self.limiter = limiter or RateLimiter()
+		self.lock = threading.Lock()
+		self.thread = None
+		self.latency = QueueLatency()
+		self.log_error = Logger(format_color = (210, 80, 80), bold = False, level = ERROR)
+	
+	def put(self, data: str, method: str | None = None, written = None) -> None:
+		if self.thread is None:
+			self.start()
+		self.limiter.put((time.perf_counter(), data, written), method)
+	
+	def start(self) -> None:
+		with self.lock:
+			if self.thread is None:
+				self.thread = threading.Thread(target = self.run, name = "Mucklet-writer", daemon = True)
+				self.thread.start()
+	
+	def run(self) -> None:
+		while True:
+			items = [self.limiter.get()]
+			while len(items) < self.batch_size:
+				item = self.limiter.get(block = False)
+				if item is None:
+					break
+				items.append(item)
+			for _, _, written in items:
+				if written is not None:
+					written()
+			try:
+				self.write([data for _, data, _ in items])
+			except Exception:
+				self.log_error(f"Failed to write {len(items)} frames:\n{traceback.format_exc()}", False)
+			self.latency.observe([enqueued for enqueued, _, _ in items])
+	
+	@property
+	def depth(self) -> int:
+		return self.limiter.depth
+	
+	def stats(self) -> dict:
+		return {"depth": self.depth, "lanes": self.limiter.depths, **self.latency.stats()}
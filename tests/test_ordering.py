@@ -0,0 +1,80 @@
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Mucklet import Bot
+from Mucklet import ResClient
+from Mucklet.gateway import Gateway
+from Mucklet.metrics import Metrics
+from Mucklet.runner import HandlerRunner
+
+
+class RunnerOrderingTest(unittest.TestCase):
+	def setUp(self):
+		self.runner = HandlerRunner(Metrics())
+
+	def tearDown(self):
+		self.runner.close()
+
+	def test_same_key_runs_in_order_under_a_slow_handler(self):
+		handled = []
+		finished = threading.Event()
+
+		def handler(number: int):
+			time.sleep(random.uniform(0, 0.01))
+			handled.append(number)
+			if len(handled) == 100:
+				finished.set()
+
+		for number in range(100):
+			self.runner.run(handler, number, key = "character")
+		self.assertTrue(finished.wait(10))
+		self.assertEqual(handled, list(range(100)))
+
+	def test_other_keys_are_not_held_up(self):
+		release = threading.Event()
+		handled = threading.Event()
+		self.runner.run(release.wait, 5, key = "slow")
+		self.runner.run(handled.set, key = "fast")
+		self.assertTrue(handled.wait(1))
+		self.assertFalse(release.is_set())
+		release.set()
+
+
+class BotOrderingTest(unittest.TestCase):
+	def setUp(self):
+		self.gateway = Gateway().start()
+		self.characters = self.gateway.populate(characters = 5, rooms = 1, seed = 1)
+		self.bot = Bot(self.gateway.token, ResClient(self.gateway.url, self.gateway.origin))
+
+	def tearDown(self):
+		self.bot.client.close()
+		self.bot.runner.close()
+		self.gateway.close()
+
+	def test_a_characters_says_reach_a_slow_handler_in_order(self):
+		character = self.characters[0]
+		handled = []
+		finished = threading.Event()
+
+		@self.bot.on("say", characters = character)
+		def on_say(event):
+			time.sleep(random.uniform(0, 0.01))
+			handled.append(int(event.event.message))
+			if len(handled) == 100:
+				finished.set()
+
+		self.bot.boot()
+		for number in range(100):
+			self.gateway.message(character, "say", str(number))
+		self.assertTrue(finished.wait(10))
+		self.assertEqual(handled, list(range(100)))
+
+
+if __name__ == "__main__":
+	unittest.main()